@@ -47,15 +47,17 @@ def get_absolute_value(image, debug=0, n=1.0, transmittance=1, vignette=lambda t
 	return np.nan if np.isnan(L) else int(L / 10_000) # to make results more readable, "cd/cm^2"
 
 def main(imagefiles, cap=-1, chartfile=None, debug=0, group_regex='.*', platefile=None,
-		plate_control=['B'], plate_ignore=[], silent=False):
+		plate_control=['B'], plate_ignore=[], silent=False, workers=1, roi=False, mask_cache=True,
+		cache=None, cache_contents=False, stream=False, mask_level=0):
 	results = {}
 
 	schematic = analyze.get_schematic(platefile, len(imagefiles), plate_ignore)
 	groups = list(dict.fromkeys(schematic))# deduplicated copy of `schematic`
 	pattern = re.compile(group_regex)
-	images = [analyze.Image(filename, group, debug) \
+	images = [analyze.Image(filename, group, debug, roi, mask_cache, mask_level) \
 		for filename, group in zip(imagefiles, schematic) \
 			if group in plate_control or pattern.search(group)]
+	analyze.calculate_raw_values(images, workers, cache, cache_contents, stream)
 
 	pattern = re.compile(group_regex)
 	for group in groups:
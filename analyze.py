@@ -1,4 +1,5 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 import csv
 import numpy as np
 import os
@@ -35,10 +36,11 @@ class Image:
 	replacement_mask = replacement_mask
 	replacement_subtr = replacement_subtr
 
-	def __init__(self, filename, group, debug=0):
+	def __init__(self, filename, group, debug=0, roi=False, mask_cache=True, mask_level=0):
 		self.fl_filename = filename
 		self.bf_filename = filename.replace(self.replacement_brfld[0], self.replacement_brfld[1])
 		self.subtr_filename = filename.replace(self.replacement_subtr[0], self.replacement_subtr[1])
+		self.mask_filename = filename.replace(self.replacement_mask[0], self.replacement_mask[1])
 
 		match = re.search(r'([a-zA-Z0-9]+)_XY([0-9][0-9])_', filename)
 		if not match:
@@ -49,6 +51,9 @@ class Image:
 
 		self.group = group
 		self.debug = debug
+		self.roi = roi
+		self.mask_cache = mask_cache
+		self.mask_level = mask_level
 
 		self.bf_img = None
 		self.bf_metadata = None
@@ -68,9 +73,13 @@ class Image:
 
 	def get_bf_metadata(self):
 		if self.bf_metadata is None:
-			self.bf_metadata = keyence.extract_metadata(self.bf_filename)
+			self.bf_metadata = keyence.get_metadata(self.bf_filename)
 		return self.bf_metadata
 
+	def get_fingerprints(self, content=False):
+		filenames = (self.fl_filename, self.bf_filename, self.subtr_filename, self.mask_filename)
+		return [util.get_file_fingerprint(filename, content) for filename in filenames]
+
 	def get_fl_img(self):
 		if self.fl_img is None:
 			with warnings.catch_warnings():
@@ -80,7 +89,7 @@ class Image:
 
 	def get_fl_metadata(self):
 		if self.fl_metadata is None:
-			self.fl_metadata = keyence.extract_metadata(self.fl_filename)
+			self.fl_metadata = keyence.get_metadata(self.fl_filename)
 		return self.fl_metadata
 
 	def get_mask(self):
@@ -89,12 +98,24 @@ class Image:
 				self.get_bf_img(), self.get_fl_img(), particles=self.particles,
 				silent=self.debug < 1, verbose=self.debug >= 2,
 				v_file_prefix='{}_XY{:02d}'.format(self.plate, self.xy),
-				mask_filename=self.fl_filename.replace(
-					self.replacement_mask[0], self.replacement_mask[1]),
-				subtr_img=self.get_subtr_img()
+				mask_filename=self.mask_filename,
+				subtr_img=self.get_subtr_img(),
+				roi=self.roi,
+				mask_cachefile=(
+					self.get_mask_cachefile() if self.mask_cache and self.debug < 1 else None),
+				level=self.mask_level,
 			)
 		return self.mask
 
+	def get_mask_cachefile(self):
+		filenames = (self.bf_filename, self.fl_filename, self.subtr_filename)
+		return util.get_mask_cachefile(
+			fingerprints=[util.get_file_fingerprint(filename, content=True) for filename in filenames],
+			channels=(self.channel, self.channel_subtr),
+			level=self.mask_level,
+			roi=self.roi,
+			version=imageops.MASK_STEPS_VERSION)
+
 	def get_raw_value(self):
 		if self.value is None:
 			fl_img_masked = imageops.apply_mask(self.get_fl_img(), self.get_mask())
@@ -126,9 +147,54 @@ class Image:
 			self.normalized_value = np.nan
 		return self
 
+	def release(self):
+		# drop pixel data, keeping filenames and values; anything released is reloaded if needed
+		self.bf_img = None
+		self.fl_img = None
+		self.subtr_img = None
+		self.mask = None
+		return self
+
 class UserError(ValueError):
 	pass
 
+def calculate_raw_values(images, workers=1, cache=None, cache_contents=False, stream=False):
+	if cache is not None:
+		fingerprints = [img.get_fingerprints(cache_contents) for img in images]
+		for img, img_fingerprints in zip(images, fingerprints):
+			entry = cache.get(os.path.abspath(img.fl_filename)) # stores are shared across inputs
+			if img.value is None and entry and entry['fingerprints'] == img_fingerprints:
+				img.value = entry['value']
+
+	pending = [img for img in images if img.value is None]
+
+	if workers > 1 and len(pending) > 1:
+		# images are pickled before any pixel data is loaded, so only filenames cross processes
+		with ProcessPoolExecutor(max_workers=workers) as executor:
+			for img, value in zip(pending, executor.map(_get_raw_value, pending)):
+				img.value = value
+	else:
+		for img in pending:
+			img.get_raw_value()
+			if stream: # so memory use is bounded by one image rather than the whole experiment
+				img.release()
+
+	if cache is not None:
+		for img, img_fingerprints in zip(images, fingerprints):
+			cache[os.path.abspath(img.fl_filename)] = {
+				'plate': img.plate,
+				'xy': img.xy,
+				'group': img.group,
+				'fl_filename': os.path.abspath(img.fl_filename),
+				'bf_filename': img.bf_filename,
+				'subtr_filename': img.subtr_filename,
+				'mask_filename': img.mask_filename,
+				'fingerprints': img_fingerprints,
+				'value': float(img.value),
+			}
+
+	return images
+
 def chart(results, chartfile, scale='linear'):
 	with sns.axes_style(style='whitegrid'):
 		data = pd.DataFrame({
@@ -173,13 +239,15 @@ def get_schematic(platefile, target_count, plate_ignore=[], flat=True):
 	return schematic if not flat else [well for row in schematic for well in row]
 
 def main(imagefiles, cap=-1, chartfile=None, debug=0, group_regex='.*', platefile=None,
-		plate_control=['B'], plate_ignore=[], silent=False):
+		plate_control=['B'], plate_ignore=[], silent=False, workers=1, roi=False, mask_cache=True,
+		cache=None, cache_contents=False, stream=False, mask_level=0):
 	results = {}
 
 	schematic = get_schematic(platefile, len(imagefiles), plate_ignore)
 	groups = list(dict.fromkeys(schematic))# deduplicated copy of `schematic`
 	images = quantify(imagefiles, plate_control, cap=cap, debug=debug, group_regex=group_regex,
-		schematic=schematic)
+		schematic=schematic, workers=workers, roi=roi, mask_cache=mask_cache, cache=cache,
+		cache_contents=cache_contents, stream=stream, mask_level=mask_level)
 
 	pattern = re.compile(group_regex)
 	for group in groups:
@@ -196,10 +264,14 @@ def main(imagefiles, cap=-1, chartfile=None, debug=0, group_regex='.*', platefil
 
 	return results
 
-def quantify(imagefiles, plate_control=['B'], cap=-1, debug=0, group_regex='.*', schematic=None):
+def quantify(imagefiles, plate_control=['B'], cap=-1, debug=0, group_regex='.*', schematic=None,
+		workers=1, roi=False, mask_cache=True, cache=None, cache_contents=False, stream=False,
+		mask_level=0):
 	pattern = re.compile(group_regex)
-	images = [Image(filename, group, debug) for filename, group in zip(imagefiles, schematic)
-		if group in plate_control or pattern.search(group)]
+	images = [Image(filename, group, debug, roi, mask_cache, mask_level)
+		for filename, group in zip(imagefiles, schematic)
+			if group in plate_control or pattern.search(group)]
+	calculate_raw_values(images, workers, cache, cache_contents, stream)
 	control_values = _calculate_control_values(images, plate_control)
 	return [image.normalize(control_values, cap) for image in images]
 
@@ -220,6 +292,9 @@ def _calculate_control_values(images, plate_control):
 def _clean(s):
 	return ''.join(c for c in s if c.isprintable()).strip()
 
+def _get_raw_value(img):
+	return img.get_raw_value()
+
 #
 # main
 #
@@ -267,6 +342,33 @@ def set_arguments(parser):
 		help=('Indicates intermediate processing images should be output for troubleshooting '
 			'purposes. Including this argument once will yield one intermediate image per input '
 			'file, twice will yield several intermediate images per input file.'))
+	parser.add_argument('--roi',
+		action='store_true',
+		help=('If present, masking steps after the initial brightfield thresholding are restricted '
+			'to the bounding box of the fish, found as the largest cluster of candidate pixels, '
+			'with a margin covering how far the outline steps reach. Yields the same fish outline '
+			'as the full frame with less pixel work, leaving out only debris too far away to '
+			'join it.'))
+	parser.add_argument('--mask-level',
+		default=0,
+		type=int,
+		help=('Pyramid level at which to find the fish outline, each level halving the resolution '
+			'of the brightfield image. The outline is upsampled afterwards; particles are still '
+			'found and scored at full resolution. See imageops.py --level for agreement figures.'))
+	parser.add_argument('--no-mask-cache',
+		action='store_false',
+		dest='mask_cache',
+		help=('If present, computed fish masks will neither be read from nor written to the mask '
+			'cache in the log directory. Masks are never cached when debugging.'))
+	parser.add_argument('--stream',
+		action='store_true',
+		help=('If present, pixel data for each image is discarded as soon as it has been scored, '
+			'so memory use does not grow with the number of images.'))
+	parser.add_argument('-w', '--workers',
+		default=1,
+		type=int,
+		help=('Number of processes to use when quantifying images. Values are identical to those '
+			'produced by a single process, just computed in parallel.'))
 	parser.add_argument('-s', '--silent',
 		action='store_true',
 		help=('If present, printed output will be suppressed. More convenient for programmatic '
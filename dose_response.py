@@ -1,4 +1,7 @@
+import atexit
+from concurrent.futures import ProcessPoolExecutor
 import csv
+import functools
 import numpy as np
 import os
 import os.path
@@ -6,6 +9,7 @@ import pandas as pd
 from matplotlib.ticker import PercentFormatter
 import matplotlib.pyplot as plt
 import scipy.optimize
+import scipy.stats
 import seaborn as sns
 import sys
 from time import time
@@ -13,12 +17,19 @@ import warnings
 
 import util
 
+BOOTSTRAP_BLOCK_SIZE = 100 # resamples per task, each with its own spawned random stream
+BATCH_SUSPECT_SLOPES = (0.5, 50) # batch fits with slopes outside these are checked one by one
+FIT_VERSION = 2 # increment whenever fitting changes, invalidating cached fits
 LOG_DIR = f'{util.get_config("log_dir")}/dose_response'
 os.makedirs(LOG_DIR, exist_ok=True)
+_fitfile = None # defaults to the fit cache under log_dir
+_fits = None # loaded on first use, and saved once at exit if any fit was added or used
+_fits_changed = False
+_warm_starts = None
 _neo_model = None
 
 class Model:
-	def __init__(self, xs, ys, cocktail, E_0=100, E_max=None):
+	def __init__(self, xs, ys, cocktail, E_0=100, E_max=None, params=None, pcov=None):
 		self.cocktail = cocktail
 		self.combo = len(cocktail.drugs) > 1
 		self.xs = xs
@@ -27,25 +38,14 @@ class Model:
 		self.E_max = E_max
 
 		self.equation = lambda xs, b, c, e: log_logistic_model(xs, b, c, E_0, e)
-		if ys and len(ys) >= 4:
-			with warnings.catch_warnings():
-				warnings.simplefilter('ignore', RuntimeWarning)
-				warnings.simplefilter('ignore', scipy.optimize.OptimizeWarning)
-				fits = {}
-				for method in ('lm', 'trf', 'dogbox'):
-					try:
-						popt, _ = scipy.optimize.curve_fit(self.equation, self.xs, self.ys,
-							method=method)
-						sse = sum((self.equation(xs, *popt) - ys)**2)
-						fits[sse] = popt
-					except:
-						pass
-				if not fits:
-					self.b, self.c, self.e = None, None, None
-				else:
-					self.b, self.c, self.e = fits[min(fits)]
-		else:
-			self.b, self.c, self.e = None, None, None
+		self.b, self.c, self.e = None, None, None
+		self.pcov = pcov
+		if params is not None: # already fit, e.g. by fit_log_logistic_batch
+			self.b, self.c, self.e = params
+		elif ys and len(ys) >= 4:
+			popt, self.pcov = fit_log_logistic(xs, ys, E_0, name=str(cocktail))
+			if popt is not None:
+				self.b, self.c, self.e = popt
 
 	def __repr__(self):
 		return "{}({})".format(self.__class__.__name__, self.cocktail)
@@ -106,32 +106,21 @@ class Model:
 			plt.close()
 			plt.clf()
 
-	# pct_survival = (f(x) - min) / (max - min)
-	# f(x) = c + (d - c) / (1 + (x / e)**b)
-	# yields x
+	# `pct_inhibition` may be a scalar or an array of inhibition levels
 	def effective_concentration(self, pct_inhibition, silent=False):
-		if pct_inhibition <= 0 or pct_inhibition >= 1:
-			raise RuntimeError('Inhibition level must be between 0 and 1')
-
-		if not self.b:
-			return np.nan
+		concentrations = effective_concentrations([self], pct_inhibition)[0]
 
-		b = self.b
-		c = self.c
-		d = self.E_0
-		e = self.e
-		max_ = self.E_0
-		min_ = self.get_absolute_E_max()
-		pct_survival = 1 - pct_inhibition
+		if self.b and not silent and np.any(np.isnan(concentrations)):
+			unreachable = np.asarray(pct_inhibition)[np.isnan(concentrations)]
+			ec_labels = ', '.join(f'EC_{int(level*100)}' for level in np.atleast_1d(unreachable))
+			print(f'WARN: {self.get_condition()} {ec_labels} is unreachable')
 
-		pct_pts_above_E_max = pct_survival * (max_ - min_) + min_ - c
-
-		if pct_pts_above_E_max <= 0:
-			if not silent:
-				print(f'WARN: {self.get_condition()} EC_{int(pct_inhibition*100)} is unreachable')
-			return np.nan
+		return concentrations
 
-		return e * ((d - c)/pct_pts_above_E_max - 1)**(1/b)
+	def effective_concentration_ci(self, pct_inhibition, alpha=0.05):
+		concentration_los, concentration_his = effective_concentration_cis(
+			[self], pct_inhibition, alpha)
+		return concentration_los[0], concentration_his[0]
 
 	def get_absolute_E_max(self):
 		return self.E_max if self.E_max is not None else self.c
@@ -146,8 +135,7 @@ class Model:
 		if not isinstance(other, Model):
 			return np.nan
 
-		other_adj = Model(np.array(other.xs) * ratio, other.ys, other.cocktail, other.E_0,
-			other.E_max)
+		other_adj = other.scale_doses(ratio)
 
 		f_intersection_equals_zero = lambda xs: np.array(
 			self.equation(xs, self.b, self.c, self.e) \
@@ -162,18 +150,10 @@ class Model:
 			lambda xs: other_adj.equation(xs, other_adj.b, other_adj.c, other_adj.e),
 			guess)
 
-	# pct_survival = (f(x) - min) / (max - min)
 	def get_pct_survival(self, xs=None, ys=None):
-		if xs is None and ys is None:
-			raise ValueError('One of xs or ys is required')
-
-		max_ = self.E_0
-		min_ = self.get_absolute_E_max()
-
-		if not ys:
-			ys = self.get_ys(xs)
-
-		return (ys - min_) / (max_ - min_)
+		if ys is None:
+			return get_pct_survivals([self], xs=xs)[0]
+		return get_pct_survivals([self], ys=ys)[0]
 
 	def get_x_units(self):
 		return self.xs[-1].get_units()
@@ -181,15 +161,24 @@ class Model:
 	def get_ys(self, xs):
 		return self.equation(xs, self.b, self.c, self.e)
 
+	# reversing the order of the drugs doesn't change the total doses, so the fit is unchanged
 	def pivot(self):
 		xs = [x.reverse() for x in self.xs]
-		return Model(xs, self.ys, xs[-1].get_cocktail(), self.E_0, self.E_max)
+		return Model(xs, self.ys, xs[-1].get_cocktail(), self.E_0, self.E_max,
+			params=(self.b, self.c, self.e), pcov=self.pcov)
+
+	# f(x * ratio) with e' = e * ratio is f(x) with e, so the scaled model needs no refitting
+	def scale_doses(self, ratio):
+		scaling = np.diag([1, 1, float(ratio)])
+		return Model(np.array(self.xs) * ratio, self.ys, self.cocktail, self.E_0, self.E_max,
+			params=(self.b, self.c, None if self.e is None else self.e * float(ratio)),
+			pcov=(None if self.pcov is None else scaling @ self.pcov @ scaling))
 
 	def __repr__(self):
 		return str(self.__dict__)
 
 def analyze_checkerboard(model_a, model_b, models_combo, method='interpolation',
-		file_name_context=None, effect_level=0.5):
+		file_name_context=None, effect_level=0.5, datapoints=None):
 	file_name_context1 = ''
 	file_name_context2 = ''
 	if file_name_context:
@@ -221,22 +210,23 @@ def analyze_checkerboard(model_a, model_b, models_combo, method='interpolation',
 		plt.scatter(0, ec_b, color='black', s=16)
 
 		fics, max_x, max_y = [], 1, 1
+		ec_combos = effective_concentrations(models_combo, effect_level)
+		ratios = [model_combo.cocktail.ratio for model_combo in models_combo]
+		ec_combo_theors, _ = get_combo_additive_expectations(effect_level, model_a, model_b, ratios)
+		combo_fics = get_combo_FICs(effect_level, model_a, model_b, models_combo, ratios)
 
-		for model_combo in models_combo:
+		for model_combo, ec_combo, ec_combo_theor, fic in zip(
+				models_combo, ec_combos, ec_combo_theors, combo_fics):
 			if not model_combo.b: # some combos will not have enough datapoints: skip
 				continue
 
-			ec_combo = model_combo.effective_concentration(effect_level)
 			ec_combo_a = ec_combo * model_combo.cocktail.ratio.to_proportion()
 			ec_combo_b = ec_combo * model_combo.cocktail.ratio.reciprocal().to_proportion()
 
-			ec_combo_theor = get_combo_additive_expectation(
-				effect_level, model_a, model_b, model_combo, model_combo.cocktail.ratio, plot=False)
-
 			color = 'tab:red' if ec_combo > ec_combo_theor else 'tab:green'
 			plt.scatter(ec_combo_a, ec_combo_b, color=color, s=16)
 
-			fic = get_combo_FIC(effect_level, model_a, model_b, model_combo,
+			fic_lo, fic_hi = get_combo_FIC_ci(effect_level, model_a, model_b, model_combo,
 				model_combo.cocktail.ratio)
 			fics.append(fic)
 
@@ -247,7 +237,8 @@ def analyze_checkerboard(model_a, model_b, models_combo, method='interpolation',
 
 			print((f'{model_combo.cocktail} EC{effect_pretty} = '
 				f'{ec_combo_a:.1f}{model_a.get_x_units()} + {ec_combo_b:.1f}{model_b.get_x_units()}'
-				f'; FIC = {fic:.2f}; ({len(model_combo.ys)} datapoints)'))
+				f'; FIC = {fic:.2f} (95% CI {fic_lo:.2f}-{fic_hi:.2f}); '
+				f'({len(model_combo.ys)} datapoints)'))
 
 			max_x = max(ec_a + offset_x, ec_combo_a + offset_x, max_x)
 			max_y = max(ec_b + offset_y, ec_combo_b + offset_y, max_y)
@@ -261,6 +252,9 @@ def analyze_checkerboard(model_a, model_b, models_combo, method='interpolation',
 
 		print('Combined FIC for the whole checkerboard (by interpolation analysis):',
 			f'{combined_fic:.2f}')
+		print('Combined FIC by effect level:')
+		print(get_FIC_spectrum(model_a, model_b, models_combo).to_string(
+			index=False, float_format=lambda value: f'{value:.2f}'))
 
 		inhibition_max_a = 1 - model_a.get_pct_survival(ys=model_a.c)
 		inhibition_max_b = 1 - model_a.get_pct_survival(ys=model_b.c)
@@ -282,35 +276,38 @@ def analyze_checkerboard(model_a, model_b, models_combo, method='interpolation',
 			os.path.join(LOG_DIR, f'{model_a.cocktail}+{model_b.cocktail}_isoboles_{uniq_str}.png'))
 		plt.close()
 		plt.clf()
-	elif method == 'Bliss':
+	elif method in ('Bliss', 'Loewe'):
 		# following Bansal 2014, https://doi.org/10.1038/nbt.3052
 
 		label_a = f'{model_a.cocktail} Concentration ({model_a.get_x_units()})'
 		label_b = f'{model_b.cocktail} Concentration ({model_b.get_x_units()})'
+		label_ixn = f'{method} Interaction'
 
-		data_dict = {}
-		data_dict[label_a] = [float(x) for x in model_a.xs]
-		data_dict[label_b] = [0] * len(model_a.xs)
-		data_dict['Bliss Interaction'] = [np.nan for y in model_a.ys]
-		data_dict[label_a] = np.append(data_dict[label_a], [0] * len(model_b.xs))
-		data_dict[label_b] = np.append(data_dict[label_b], [float(x) for x in model_b.xs])
-		data_dict['Bliss Interaction'] = np.append(data_dict['Bliss Interaction'],
-			[np.nan for y in model_b.ys])
-
-		for model_combo in models_combo:
-			xs = np.array([float(x) for x in model_combo.xs])
-			data_dict[label_a] = np.append(data_dict[label_a],
-				xs * model_combo.cocktail.ratio.to_proportion())
-			data_dict[label_b] = np.append(data_dict[label_b],
-				xs * model_combo.cocktail.ratio.reciprocal().to_proportion())
-			data_dict['Bliss Interaction'] = np.append(data_dict['Bliss Interaction'],
-				[get_bliss_ixn(x, y, model_a, model_b, model_combo) \
-					for x, y in zip(model_combo.xs, model_combo.ys)])
-
-		data = pd.DataFrame(data_dict)
+		if method == 'Bliss':
+			xs_combo, excesses = get_bliss_excesses(model_a, model_b, models_combo, datapoints)
+		else:
+			xs_combo, excesses, converged = get_loewe_excesses(
+				model_a, model_b, models_combo, datapoints)
+			if not np.all(converged):
+				print(f'WARN: Loewe expectation did not converge for {np.sum(~converged)} of '
+					f'{len(converged)} solutions')
+		# the excess is affine in the response, so the median excess is the excess of the median
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore', RuntimeWarning) # all-NaN rows, e.g. controls
+			excesses = np.nanmedian(excesses, axis=1)
+		ratios = [model_combo.cocktail.ratio for model_combo in models_combo \
+			for _ in model_combo.xs]
+
+		data = pd.DataFrame({
+			label_a: [float(x) for x in model_a.xs] + [0] * len(model_b.xs) + \
+				[float(x) * ratio.to_proportion() for x, ratio in zip(xs_combo, ratios)],
+			label_b: [0] * len(model_a.xs) + [float(x) for x in model_b.xs] + [float(x) * \
+				ratio.reciprocal().to_proportion() for x, ratio in zip(xs_combo, ratios)],
+			label_ixn: np.concatenate(
+				(np.full(len(model_a.xs) + len(model_b.xs), np.nan), excesses)),
+		})
 		data = data.pivot_table(
-			index=label_a, columns=label_b, values='Bliss Interaction', aggfunc='mean',
-			dropna=False)
+			index=label_a, columns=label_b, values=label_ixn, aggfunc='mean', dropna=False)
 
 		fig = plt.figure(figsize=(12, 8), dpi=100)
 		ax = sns.heatmap(data,
@@ -318,7 +315,7 @@ def analyze_checkerboard(model_a, model_b, models_combo, method='interpolation',
 			square=True,
 			cbar_kws={
 				'extend': 'both',
-				'label': 'Excess Over Bliss',
+				'label': f'Excess Over {method}',
 				# 'location': 'bottom',
 				# 'shrink': 0.5,
 				'ticks': [-1, 0, 1],
@@ -327,17 +324,15 @@ def analyze_checkerboard(model_a, model_b, models_combo, method='interpolation',
 			['-1 (Antagonism)', '0 (Noninteraction)', '+1 (Synergy)'])
 		ax.invert_yaxis()
 		plt.title(
-			f'{model_a.get_condition()} vs. {model_b.get_condition()}: Bliss Ixn ' +
+			f'{model_a.get_condition()} vs. {model_b.get_condition()}: {method} Ixn ' +
 				f'{file_name_context1}')
 		plt.tight_layout()
 		uniq_str = str(int(time() * 1000) % 1_620_000_000_000)
 		plt.savefig(
 			f'{LOG_DIR}/{model_a.get_condition()}-{model_b.get_condition()}_{file_name_context2}' +
-				f'bliss_{uniq_str}.png'
+				f'{method.lower()}_{uniq_str}.png'
 		)
 		plt.clf()
-	elif method == 'Loewe':
-		pass
 	else:
 		raise ValueException('`method` must be one of "interpolation", "Bliss", or "Loewe"')
 
@@ -428,6 +423,53 @@ def analyze_diamond(model_a, model_b, model_combo):
 	return (os.path.join(LOG_DIR, f'{model_a.cocktail}+{model_b.cocktail}_isoboles_{uniq_str}.png'),\
 		max_x, max_y)
 
+# nonparametric bootstrap of a fitted model: each solution's replicate wells (`datapoints`, as for
+# Model.chart, one entry per solution) are resampled with replacement and summarized by their
+# median, as pipeline.main does, and all resampled curves are refit at once, starting from the
+# model's own fit
+# returns percentile CIs of b, c, e, and the ECs at `pct_inhibitions`, one row each
+def bootstrap_cis(model, datapoints, pct_inhibitions=(0.5, 0.9), iterations=1000, alpha=0.05,
+		seed=None, workers=1, silent=False):
+	if not model.b:
+		raise ValueError('Only a fitted model can be bootstrapped')
+
+	pct_inhibitions = np.atleast_1d(pct_inhibitions)
+	replicates = [np.array(values, dtype=np.float64) for values in datapoints.values()]
+	block_sizes = [min(BOOTSTRAP_BLOCK_SIZE, iterations - start)
+		for start in range(0, iterations, BOOTSTRAP_BLOCK_SIZE)]
+	seed_sequences = np.random.SeedSequence(seed).spawn(len(block_sizes))
+	bootstrap_block = functools.partial(_bootstrap_block, [float(x) for x in datapoints],
+		[values[~np.isnan(values)] for values in replicates], (model.b, model.c, model.e),
+		model.cocktail, model.E_0, model.E_max, pct_inhibitions)
+
+	executor = ProcessPoolExecutor(max_workers=workers) \
+		if workers > 1 and len(block_sizes) > 1 else None
+	blocks = []
+	try:
+		for block in (executor.map if executor else map)(bootstrap_block, block_sizes,
+				seed_sequences):
+			blocks.append(block)
+			if not silent:
+				print(f'{model.get_condition()} bootstrap: {sum(len(block) for block in blocks)}/'
+					f'{iterations} resamples')
+	finally:
+		if executor:
+			executor.shutdown(cancel_futures=True)
+
+	samples = np.concatenate(blocks)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning) # e.g. an EC no resample reaches
+		ci_los, ci_his = np.nanpercentile(samples, [100 * alpha/2, 100 * (1 - alpha/2)], axis=0)
+
+	return pd.DataFrame({
+		'Parameter': ['b', 'c', 'e'] + [f'EC_{level*100:g}' for level in pct_inhibitions],
+		'Estimate': np.concatenate([[model.b, model.c, model.e],
+			effective_concentrations([model], pct_inhibitions)[0]]),
+		'CI (low)': ci_los,
+		'CI (high)': ci_his,
+		'Resamples': np.sum(~np.isnan(samples), axis=0), # those that were fit and reach the EC
+	})
+
 def chart_checkerboard(model_a, model_b, models_combo, file_name_context=None):
 	file_name_context1 = ''
 	file_name_context2 = ''
@@ -486,8 +528,7 @@ def chart_diamond(model_a, model_b, model_combo):
 
 	# chart A and B on the same axes, with the same x values
 
-	model_b_scaled = Model(np.array(model_b.xs) * model_combo.cocktail.ratio, model_b.ys,
-		model_b.cocktail, model_b.E_0, model_b.E_max)
+	model_b_scaled = model_b.scale_doses(model_combo.cocktail.ratio)
 
 	model_a.chart(close=False)
 	model_b_scaled.chart(color='tab:blue', label=False,
@@ -539,6 +580,47 @@ def do_additive_isobole(a_i, A_E50_a, B_E50_b, E_max_a, E_max_b, B_i, p, q):
 def do_FIC(a_i, b_i, A_E50_a, B_E50_b, E_max_a, E_max_b, B_i, p, q):
 	return (b_i + B_E50_b/((E_max_b/E_max_a)*(1 + A_E50_a**q/a_i**q) - 1)**(1/p)) / B_i
 
+# delta-method confidence intervals from each model's parameter covariance, on the log scale so
+# they stay positive; shaped as in effective_concentrations, and NaN where a model has no pcov
+def effective_concentration_cis(models, pct_inhibitions, alpha=0.05):
+	concentrations = effective_concentrations(models, pct_inhibitions)
+	pct_inhibitions = np.asarray(pct_inhibitions, dtype=np.float64)
+	b, c, d, e, max_, min_ = _get_model_params(models, pct_inhibitions.ndim)
+	pcovs = np.array([np.full((3, 3), np.nan) if model.pcov is None else model.pcov \
+		for model in models], dtype=np.float64).reshape((-1, 3, 3) + (1,) * pct_inhibitions.ndim)
+	# without a fixed E_max, min_ is c itself, and the concentrations don't depend on c at all
+	c_dependent = np.array([model.E_max is not None for model in models]).reshape(b.shape)
+
+	pct_pts_above_E_max = (1 - pct_inhibitions) * (max_ - min_) + min_ - c
+	with np.errstate(all='ignore'):
+		base = (d - c)/pct_pts_above_E_max - 1 # concentration = e * base**(1/b)
+		gradients = np.stack([
+			-concentrations * np.log(base) / b**2, # ∂/∂b
+			np.where(c_dependent, concentrations / (b * base) \
+				* (d - c - pct_pts_above_E_max) / pct_pts_above_E_max**2, 0), # ∂/∂c
+			concentrations / e, # ∂/∂e
+		], axis=1)
+		variances = np.einsum('ni...,nij...,nj...->n...', gradients, pcovs, gradients)
+		return _get_log_scale_ci(concentrations, variances, alpha)
+
+# pct_survival = (f(x) - min) / (max - min)
+# f(x) = c + (d - c) / (1 + (x / e)**b)
+# yields x for every model (first axis) and every inhibition level (remaining axes) in one pass,
+# with NaN wherever a model is unfit or never reaches a level
+def effective_concentrations(models, pct_inhibitions):
+	pct_inhibitions = np.asarray(pct_inhibitions, dtype=np.float64)
+	if np.any((pct_inhibitions <= 0) | (pct_inhibitions >= 1)):
+		raise RuntimeError('Inhibition level must be between 0 and 1')
+
+	b, c, d, e, max_, min_ = _get_model_params(models, pct_inhibitions.ndim)
+	pct_survivals = 1 - pct_inhibitions
+
+	pct_pts_above_E_max = pct_survivals * (max_ - min_) + min_ - c
+
+	with np.errstate(all='ignore'):
+		concentrations = e * ((d - c)/pct_pts_above_E_max - 1)**(1/b)
+	return np.where(pct_pts_above_E_max > 0, concentrations, np.nan)
+
 def filter_valid(array, minimum=None, tolerance=None):
 	if minimum is not None:
 		array = [element for element in array if element >= minimum]
@@ -558,39 +640,170 @@ def filter_valid(array, minimum=None, tolerance=None):
 
 	return array
 
-def get_bliss_ixn(x, y, model_a, model_b, model_combo):
-	if float(x) == 0:
-		return np.nan
-
-	# concentration_a = x * model_combo.cocktail.ratio.to_proportion()
-	# concentration_b = x * model_combo.cocktail.ratio.reciprocal().to_proportion()
-	x_doses = {dose.drug: dose for dose in x.doses}
-	dose_a = x_doses[model_a.cocktail.drugs[0]]
-	dose_b = x_doses[model_b.cocktail.drugs[0]]
-
-	model_a_doses = [solution.doses[0] for solution in model_a.xs]
-	model_b_doses = [solution.doses[0] for solution in model_b.xs]
-
-	if dose_a in model_a_doses:
-		pct_survival = (model_a.ys[model_a_doses.index(dose_a)] - model_a.get_absolute_E_max()) / \
-			(model_a.E_0 - model_a.get_absolute_E_max())
-		e_inhibition_a = 1 - pct_survival
-	else:
-		print(f'WARNING: {dose_a} not found in {model_a}. Using modeled response.')
-		e_inhibition_a = 1 - model_a.get_pct_survival(xs=float(dose_a))
-
-	if dose_b in model_b_doses:
-		pct_survival = (model_b.ys[model_b_doses.index(dose_b)] - model_a.get_absolute_E_max()) / \
-			(model_b.E_0 - model_b.get_absolute_E_max())
-		e_inhibition_b = 1 - pct_survival
-	else:
-		print(f'WARNING: {dose_b} not found in {model_b}. Using modeled response.')
-		e_inhibition_b = 1 - model_b.get_pct_survival(xs=float(dose_b))
-
-	fract_inhib_theor = e_inhibition_a + e_inhibition_b - e_inhibition_a * e_inhibition_b
-	fract_inhib_observed = 1 - model_combo.get_pct_survival(ys=y)
+# fits b, c, and e of log_logistic_model with d fixed, from data-driven starting values and with
+# an analytic Jacobian; further methods are only tried if the first fit fails its diagnostics
+# returns the parameters and their covariance matrix, or (None, None) if no method succeeded
+# with `cache`, fits persist across runs, keyed by the data, d, and methods (E_max isn't fit)
+def fit_log_logistic(xs, ys, d=100, methods=('lm', 'trf', 'dogbox'), name='curve', cache=True):
+	xs = np.array([float(x) for x in xs])
+	ys = np.array(ys, dtype=np.float64)
+	equation = lambda xs, b, c, e: log_logistic_model(xs, b, c, d, e)
+
+	if not cache:
+		return _fit_log_logistic(xs, ys, d, methods, name)
+
+	# earlier fits of the same doses, e.g. before another replicate plate, are used as warm starts
+	fits = _get_fits()
+	key, doses_key = _get_fit_keys(xs, ys, d, methods)
+	if key not in fits:
+		popt, pcov = _fit_log_logistic(xs, ys, d, methods, name,
+			_get_warm_starts().get(doses_key))
+		sse = None if popt is None else np.sum((ys - equation(xs, *popt))**2)
+		_add_fit(key, _get_fit_entry(doses_key, popt, pcov, sse))
+	_use_fit(key)
+
+	if fits[key]['params'] is None:
+		return None, None
+	return np.array(fits[key]['params']), np.array(fits[key]['pcov'])
+
+# fits many curves at once with Levenberg-Marquardt iterations vectorized across curves
+# xs and ys are (curves, points) arrays, with NaN padding for curves having fewer points
+# returns a (curves, 3) array of b, c, and e (NaN where unfit), and whether each fit converged
+# `guesses`, one for all curves or one per curve, replace the data-driven starting values
+# with `verify`, fits that may be local minima (nearly flat, step-like, or with the inflection
+# point below the lowest dose) are refit with fit_log_logistic, keeping the lower SSE
+def fit_log_logistic_batch(xs, ys, d=100, max_iterations=200, tolerance=1e-10, cache=True,
+		guesses=None, verify=True):
+	if len(xs) == 0: # no curves, e.g. when none has enough points
+		return np.empty((0, 3)), np.empty(0, dtype=bool)
+
+	xs = np.atleast_2d(np.array(xs, dtype=np.float64))
+	ys = np.atleast_2d(np.array(ys, dtype=np.float64))
+	keys = [_get_fit_keys(curve_xs, curve_ys, d, ('batch', max_iterations, tolerance, verify)) \
+		for curve_xs, curve_ys in zip(xs, ys)] if cache else []
+	valid = ~np.isnan(xs) & ~np.isnan(ys)
+	xs = np.where(valid, xs, 0)
+	ys = np.where(valid, ys, 0)
+
+	# same starting values as fit_log_logistic, per curve
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning) # curves without any valid points
+		guess_c = np.nanmin(np.where(valid, ys, np.nan), axis=1)
+		guess_e = np.nanmedian(np.where(valid & (xs > 0), xs, np.nan), axis=1)
+	params = np.column_stack([
+		np.ones(len(xs)), np.where(guess_c < d, guess_c, d - 1), np.nan_to_num(guess_e, nan=1.0)])
+	if guesses is not None:
+		params[:] = guesses
+	converged = np.zeros(len(xs), dtype=bool)
+
+	# curves fit before are taken from the cache, and others start from earlier fits of their doses
+	cached = np.zeros(len(xs), dtype=bool)
+	if cache:
+		fits = _get_fits()
+		warm_starts = _get_warm_starts()
+		for i, (key, doses_key) in enumerate(keys):
+			if key in fits:
+				cached[i] = True
+				converged[i] = fits[key]['params'] is not None
+				params[i] = fits[key]['params'] if converged[i] else np.nan
+			elif doses_key in warm_starts:
+				params[i] = warm_starts[doses_key]
+
+	def get_residuals(xs, ys, valid, params):
+		b, c, e = params.T[:, :, np.newaxis]
+		with np.errstate(all='ignore'):
+			residuals = np.where(valid, ys - log_logistic_model(xs, b, c, d, e), 0)
+		sses = np.sum(residuals**2, axis=1)
+		return residuals, np.where(np.isfinite(sses) & (params[:, 2] > 0), sses, np.inf)
+
+	residuals, sses = get_residuals(xs, ys, valid, params)
+	damping = np.full(len(xs), 1e-3)
+	# fewer points than parameters can't be fit
+	active = (np.sum(valid, axis=1) >= params.shape[1]) & ~cached
+
+	for _ in range(max_iterations):
+		idxs = np.flatnonzero(active)
+		if len(idxs) == 0:
+			break
+
+		b, c, e = params[idxs].T[:, :, np.newaxis]
+		with np.errstate(all='ignore'):
+			jacobian = _get_log_logistic_jacobian(xs[idxs], b, c, d, e)
+		jacobian = np.where(valid[idxs, :, np.newaxis] & np.isfinite(jacobian), jacobian, 0)
+		jtj = np.einsum('nmi,nmj->nij', jacobian, jacobian)
+		gradients = np.einsum('nmi,nm->ni', jacobian, residuals[idxs])
+
+		# Marquardt's damping, scaled by the diagonal so each parameter's units don't matter
+		diagonals = np.maximum(np.diagonal(jtj, axis1=1, axis2=2), 1e-12)
+		lhs = jtj + np.einsum('n,ni,ij->nij', damping[idxs], diagonals, np.eye(params.shape[1]))
+		steps = (np.linalg.pinv(lhs) @ gradients[:, :, np.newaxis])[:, :, 0]
+
+		candidates = params[idxs] + steps
+		candidate_residuals, candidate_sses = get_residuals(
+			xs[idxs], ys[idxs], valid[idxs], candidates)
+		improved = candidate_sses < sses[idxs]
+		relative_changes = np.where(improved,
+			(sses[idxs] - candidate_sses) / np.maximum(sses[idxs], np.finfo(np.float64).tiny), 1)
+
+		accepted = idxs[improved]
+		params[accepted] = candidates[improved]
+		residuals[accepted] = candidate_residuals[improved]
+		sses[accepted] = candidate_sses[improved]
+		damping[idxs] = np.where(improved, np.maximum(damping[idxs] / 10, 1e-12),
+			damping[idxs] * 10)
+
+		small_steps = np.all(
+			np.abs(steps) <= np.sqrt(tolerance) * (np.abs(params[idxs]) + np.sqrt(tolerance)), axis=1)
+		done = (relative_changes <= tolerance) | (sses[idxs] == 0) | small_steps
+		converged[idxs[done]] = True
+		active[idxs[done | (damping[idxs] > 1e12)]] = False # no step helps anymore: stalled
+
+	if verify:
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore', RuntimeWarning) # curves without any valid points
+			doses = np.where(valid & (xs > 0), xs, np.nan)
+			slopes, inflections = params[:, 0], params[:, 2]
+			suspect = converged & ~cached & ((slopes < BATCH_SUSPECT_SLOPES[0]) | \
+				(slopes > BATCH_SUSPECT_SLOPES[1]) | (inflections < np.nanmin(doses, axis=1)))
+		for i in np.flatnonzero(suspect):
+			popt, _ = fit_log_logistic(xs[i, valid[i]], ys[i, valid[i]], d, cache=cache)
+			if popt is not None:
+				curve = slice(i, i + 1)
+				_, (sse,) = get_residuals(xs[curve], ys[curve], valid[curve], popt[np.newaxis])
+				if sse <= sses[i]:
+					params[i], sses[i] = popt, sse
+
+	# a zero slope is a flat line, which Model takes as unfit
+	converged &= np.all(np.isfinite(params), axis=1) & (params[:, 0] != 0) & (params[:, 2] > 0)
+	params[~converged] = np.nan
+
+	if cache:
+		for i, (key, doses_key) in enumerate(keys):
+			if not cached[i]:
+				_add_fit(key, _get_fit_entry(doses_key, params[i] if converged[i] else None,
+					None, sses[i] if converged[i] else None))
+			_use_fit(key)
+
+	return params, converged
+
+# excess over Bliss (Bansal 2014, https://doi.org/10.1038/nbt.3052) of every solution of every
+# combo model at once, for each replicate in `datapoints` (solution -> responses, as for
+# Model.chart) or else for each model's ys; single-agent responses are looked up by dose, falling
+# back to the modeled response for doses that weren't tested alone
+# returns the combo solutions and their excesses, one row per solution, NaN-padded by replicate
+def get_bliss_excesses(model_a, model_b, models_combo, datapoints=None):
+	xs, fract_inhib_observed = _get_observed_inhibitions(models_combo, datapoints)
+
+	inhibitions_a = _get_bliss_inhibitions(model_a, xs)
+	inhibitions_b = _get_bliss_inhibitions(model_b, xs)
+	fract_inhib_theor = inhibitions_a + inhibitions_b - inhibitions_a * inhibitions_b
+
+	return xs, fract_inhib_observed - fract_inhib_theor[:, np.newaxis]
 
-	return fract_inhib_observed - fract_inhib_theor
+def get_bliss_ixn(x, y, model_a, model_b, model_combo):
+	model = Model([x], [y], model_combo.cocktail, model_combo.E_0, model_combo.E_max,
+		params=(model_combo.b, model_combo.c, model_combo.e))
+	return get_bliss_excesses(model_a, model_b, [model])[1][0, 0]
 
 def get_combo_additive_expectation(pct_inhibition, model_a, model_b, model_combo, combo_ratio_a,
 		plot=True):
@@ -613,7 +826,6 @@ def get_combo_additive_expectation(pct_inhibition, model_a, model_b, model_combo
 		ec_combo_a, model_a.e, model_b.e, inhibition_max_a, inhibition_max_b, ec_b_alone, model_b.b,
 		model_a.b)
 	f_diagonal = lambda ec_combo_a: ec_combo_a / combo_ratio_a
-	simplistic_additive_estimate = 1 if np.isnan(ec_a_alone) else ec_a_alone / 2
 
 	if plot:
 		plot_func(model_a.xs, f_isobole, f'{model_combo.cocktail} Additive Isobole',
@@ -628,29 +840,124 @@ def get_combo_additive_expectation(pct_inhibition, model_a, model_b, model_combo
 			f'Line of simplistic additivity', f'{model_combo.cocktail}_isobole', color='lightgrey',
 			linestyle='dashed', min_y=0)
 
-	conc_a = get_intersection(f_isobole, f_diagonal, simplistic_additive_estimate)[0]
-	conc_b = conc_a / combo_ratio_a
-	return conc_a + conc_b
+	concs, _ = get_combo_additive_expectations(pct_inhibition, model_a, model_b, [combo_ratio_a])
+	return concs[0]
+
+# the additive expectations for many combo ratios at once, each where that ratio's diagonal
+# crosses the additive isobole, found by bisection: the isobole falls from B_i at a=0 to at most
+# B_i, while the diagonal rises from 0 to B_i at a=ratio*B_i, so their difference is decreasing
+# and changes sign on [0, ratio*B_i]
+# returns the total concentrations, and whether each was bracketed and converged (else NaN)
+def get_combo_additive_expectations(pct_inhibition, model_a, model_b, combo_ratios_a,
+		tolerance=1e-12, max_iterations=100):
+	combo_ratios_a = np.array([float(ratio) for ratio in combo_ratios_a])
 
-def get_combo_FIC(pct_inhibition, model_a, model_b, model_combo, combo_ratio_a, silent=False):
 	# set model_b to the model with the higher maximum effect = lower survival at maximum effect
 	if model_a.c < model_b.c:
 		model_a, model_b = model_b, model_a
-		combo_ratio_a = combo_ratio_a.reciprocal()
+		combo_ratios_a = 1 / combo_ratios_a
 
-	ec_b_alone = model_b.effective_concentration(pct_inhibition, silent)
-	ec_combo = model_combo.effective_concentration(pct_inhibition, silent)
+	ec_b_alone = model_b.effective_concentration(pct_inhibition)
+	inhibition_max_a = 1 - model_a.get_pct_survival(ys=model_a.c)
+	inhibition_max_b = 1 - model_a.get_pct_survival(ys=model_b.c)
 
-	if np.isnan(ec_b_alone) or np.isnan(ec_combo):
-		return np.nan
+	f_excess = lambda ec_combo_a: do_additive_isobole(
+		ec_combo_a, model_a.e, model_b.e, inhibition_max_a, inhibition_max_b, ec_b_alone, model_b.b,
+		model_a.b) - ec_combo_a / combo_ratios_a
+
+	los = np.zeros(len(combo_ratios_a))
+	his = combo_ratios_a * ec_b_alone
+	with np.errstate(all='ignore'):
+		converged = np.isfinite(his) & (his > 0) & (f_excess(his) <= 0)
+		for _ in range(max_iterations):
+			mids = (los + his) / 2
+			excesses = f_excess(mids)
+			converged &= ~np.isnan(excesses)
+			los = np.where(excesses > 0, mids, los)
+			his = np.where(excesses > 0, his, mids)
+			if np.all((his - los <= tolerance * his) | ~converged):
+				break
+		else:
+			converged &= his - los <= tolerance * his
+
+	concs_a = np.where(converged, (los + his) / 2, np.nan)
+	return concs_a + concs_a / combo_ratios_a, converged
+
+def get_combo_FIC(pct_inhibition, model_a, model_b, model_combo, combo_ratio_a, silent=False):
+	if not silent: # warn of unreachable levels, from the model with the higher maximum effect
+		(model_a if model_a.c < model_b.c else model_b).effective_concentration(pct_inhibition)
+		model_combo.effective_concentration(pct_inhibition)
+
+	return get_combo_FICs(pct_inhibition, model_a, model_b, [model_combo], [combo_ratio_a])[0]
+
+# delta-method confidence interval of get_combo_FIC, from a numerical gradient with respect to all
+# three models' parameters, which are taken to be independent since each is fit separately
+def get_combo_FIC_ci(pct_inhibition, model_a, model_b, model_combo, combo_ratio_a, alpha=0.05):
+	models = (model_a, model_b, model_combo)
+	if any(model.pcov is None for model in models):
+		return np.nan, np.nan
+
+	params = np.array([(model.b, model.c, model.e) for model in models], dtype=np.float64).ravel()
+	covariance = np.zeros((len(params), len(params)))
+	for i, model in enumerate(models):
+		covariance[3*i:3*i + 3, 3*i:3*i + 3] = model.pcov
+
+	get_fic = lambda params: get_combo_FIC(pct_inhibition, *(
+		Model(model.xs, model.ys, model.cocktail, model.E_0, model.E_max, params=model_params) \
+			for model, model_params in zip(models, params.reshape(len(models), 3))),
+		combo_ratio_a, silent=True)
+
+	fic = get_fic(params)
+	gradient = np.zeros(len(params))
+	for i, step in enumerate(1e-5 * np.maximum(np.abs(params), 1)): # central differences
+		offset = np.zeros(len(params))
+		offset[i] = step
+		gradient[i] = (get_fic(params + offset) - get_fic(params - offset)) / (2 * step)
+
+	with np.errstate(all='ignore'):
+		return _get_log_scale_ci(fic, gradient @ covariance @ gradient, alpha)
+
+# FIC of every combo model (first axis) at every inhibition level (remaining axes) in one pass, as
+# get_combo_FIC computes each, with NaN wherever a combo or the single agents never reach a level
+def get_combo_FICs(pct_inhibitions, model_a, model_b, models_combo, combo_ratios_a):
+	pct_inhibitions = np.asarray(pct_inhibitions, dtype=np.float64)
+	combo_ratios_a = list(combo_ratios_a)
+
+	# set model_b to the model with the higher maximum effect = lower survival at maximum effect
+	if model_a.c < model_b.c:
+		model_a, model_b = model_b, model_a
+		combo_ratios_a = [ratio.reciprocal() for ratio in combo_ratios_a]
 
-	ec_combo_a = ec_combo * combo_ratio_a.to_proportion()
-	ec_combo_b = ec_combo * combo_ratio_a.reciprocal().to_proportion()
+	shape = (-1,) + (1,) * pct_inhibitions.ndim
+	proportions_a = np.array([float(ratio.to_proportion()) for ratio in combo_ratios_a],
+		dtype=np.float64).reshape(shape)
+	proportions_b = np.array([float(ratio.reciprocal().to_proportion()) \
+		for ratio in combo_ratios_a], dtype=np.float64).reshape(shape)
+
+	ec_b_alone = effective_concentrations([model_b], pct_inhibitions)[0]
+	ec_combos = effective_concentrations(models_combo, pct_inhibitions)
 	inhibition_max_a = 1 - model_a.get_pct_survival(ys=model_a.c)
 	inhibition_max_b = 1 - model_a.get_pct_survival(ys=model_b.c)
 
-	return do_FIC(ec_combo_a, ec_combo_b, model_a.e, model_b.e, inhibition_max_a, inhibition_max_b,
-		ec_b_alone, model_b.b, model_a.b)
+	with np.errstate(all='ignore'):
+		return do_FIC(ec_combos * proportions_a, ec_combos * proportions_b, model_a.e, model_b.e,
+			inhibition_max_a, inhibition_max_b, ec_b_alone, model_b.b, model_a.b)
+
+# FIC-vs-effect profile of a checkerboard: the geometric-mean FIC, at each inhibition level, of
+# the combo models that reach it
+# returns one row per level, with how many combos each summary covers
+def get_FIC_spectrum(model_a, model_b, models_combo, pct_inhibitions=np.linspace(0.05, 0.95, 19)):
+	pct_inhibitions = np.atleast_1d(pct_inhibitions)
+	fics = get_combo_FICs(pct_inhibitions, model_a, model_b, models_combo,
+		[model_combo.cocktail.ratio for model_combo in models_combo])
+	valid = ~np.isnan(fics)
+
+	return pd.DataFrame({
+		'Effect Level': pct_inhibitions,
+		'Combined FIC': [util.geometric_mean(level_fics[level_valid]) if np.any(level_valid) \
+			else np.nan for level_fics, level_valid in zip(fics.T, valid.T)],
+		'Combos': np.sum(valid, axis=0),
+	})
 
 def get_intersection(f1, f2, guess):
 	f_intersection_equals_zero = \
@@ -663,6 +970,103 @@ def get_intersection(f1, f2, guess):
 	except scipy.optimize.nonlin.NoConvergence as e:
 		return e.args[0]
 
+# the covariance of each fit, as curve_fit estimates it, for fits from fit_log_logistic_batch
+# xs, ys, and params are as fit_log_logistic_batch takes and returns them
+def get_log_logistic_pcovs(xs, ys, params, d=100):
+	if len(xs) == 0:
+		return np.empty((0, 3, 3))
+
+	xs = np.atleast_2d(np.array(xs, dtype=np.float64))
+	ys = np.atleast_2d(np.array(ys, dtype=np.float64))
+	valid = ~np.isnan(xs) & ~np.isnan(ys)
+	xs = np.where(valid, xs, 0)
+	b, c, e = np.asarray(params, dtype=np.float64).T[:, :, np.newaxis]
+
+	with np.errstate(all='ignore'):
+		residuals = np.where(valid, ys - log_logistic_model(xs, b, c, d, e), 0)
+		jacobian = np.where(valid[:, :, np.newaxis], _get_log_logistic_jacobian(xs, b, c, d, e), 0)
+		jtj = np.einsum('nmi,nmj->nij', jacobian, jacobian)
+		# the residual variance, with as many degrees of freedom as points beyond parameters
+		residual_variances = np.sum(residuals**2, axis=1) / (np.sum(valid, axis=1) - 3)
+	residual_variances[np.sum(valid, axis=1) <= 3] = np.nan
+
+	pcovs = np.full(jtj.shape, np.nan)
+	fit = np.all(np.isfinite(jtj), axis=(1, 2))
+	pcovs[fit] = np.linalg.pinv(jtj[fit]) * residual_variances[fit, np.newaxis, np.newaxis]
+	return pcovs
+
+# excess over Loewe additivity of every solution of every combo model at once, shaped as in
+# get_bliss_excesses, along with whether each solution's expectation converged
+def get_loewe_excesses(model_a, model_b, models_combo, datapoints=None, tolerance=1e-12,
+		max_iterations=100):
+	xs, fract_inhib_observed = _get_observed_inhibitions(models_combo, datapoints)
+	doses_a, doses_b = [[0 if dose is None else float(dose) for dose in _get_drug_doses(xs, drug)] \
+		for drug in (model_a.cocktail.drugs[0], model_b.cocktail.drugs[0])]
+
+	fract_inhib_theor, converged = get_loewe_expectations(
+		model_a, model_b, doses_a, doses_b, tolerance, max_iterations)
+	controls = np.array([float(x) == 0 for x in xs], dtype=bool)
+
+	return xs, np.where(controls[:, np.newaxis], np.nan,
+		fract_inhib_observed - fract_inhib_theor[:, np.newaxis]), converged
+
+# Loewe additivity (Greco et al. 1995, Pharmacol. Rev. 47:331): the inhibition y expected
+# of doses a and b together solves a/EC_A(y) + b/EC_B(y) = 1, where a drug that never reaches y
+# contributes nothing; the sum falls monotonically with y, so every dose pair (any matching shapes)
+# is bisected at once on [0, the higher maximum inhibition]
+# returns the expected inhibitions, NaN where unsolved, and whether each converged
+def get_loewe_expectations(model_a, model_b, doses_a, doses_b, tolerance=1e-12,
+		max_iterations=100):
+	doses = np.stack(np.broadcast_arrays(
+		np.asarray(doses_a, dtype=np.float64), np.asarray(doses_b, dtype=np.float64)))
+	if not model_a.b or not model_b.b:
+		return np.full(doses.shape[1:], np.nan), np.zeros(doses.shape[1:], dtype=bool)
+
+	untreated = np.all(doses == 0, axis=0) # no drug, no effect
+	inhibition_max = min(1,
+		max(1 - model.get_pct_survival(ys=model.c) for model in (model_a, model_b)))
+	if not inhibition_max > 0: # neither drug inhibits, e.g. both inactive, so nothing to solve
+		return np.where(untreated, 0, np.nan), untreated
+
+	def f_excess(pct_inhibitions):
+		concentrations = effective_concentrations([model_a, model_b], pct_inhibitions)
+		return np.sum(np.where(doses > 0, np.nan_to_num(doses / concentrations), 0), axis=0) - 1
+
+	los = np.zeros(doses.shape[1:])
+	his = np.full(doses.shape[1:], inhibition_max)
+	converged = np.all(np.isfinite(doses) & (doses >= 0), axis=0) & ~untreated
+	with np.errstate(all='ignore'):
+		for _ in range(max_iterations):
+			mids = (los + his) / 2
+			excesses = f_excess(mids)
+			los = np.where(excesses > 0, mids, los)
+			his = np.where(excesses > 0, his, mids)
+			if np.all((his - los <= tolerance) | ~converged):
+				break
+		else:
+			converged &= his - los <= tolerance
+
+	pct_inhibitions = np.where(converged, (los + his) / 2, np.nan)
+	return np.where(untreated, 0, pct_inhibitions), converged | untreated
+
+# pct_survival = (f(x) - min) / (max - min)
+# for every model (first axis) at every x or y (remaining axes), with NaN for unfit models' xs
+def get_pct_survivals(models, xs=None, ys=None):
+	if xs is None and ys is None:
+		raise ValueError('One of xs or ys is required')
+
+	values = np.asarray(xs if ys is None else ys, dtype=np.float64)
+
+	if ys is None:
+		b, c, d, e, max_, min_ = _get_model_params(models, values.ndim)
+		with np.errstate(all='ignore'):
+			values = log_logistic_model(values, b, c, d, e)
+	else: # scaling ys needs no fit if E_max is known
+		max_, min_ = [scale.reshape((-1,) + (1,) * values.ndim) \
+			for scale in _get_survival_scales(models)]
+
+	return (values - min_) / (max_ - min_)
+
 # Ritz 2009, https://doi.org/10.1002/etc.7, Eq. 2
 # `xs` is a numpy array of x values; b, c, d, and e are model parameters:
 # relative slope at inflection point, lower asymptote, upper asymptote, inflection point (EC_50)
@@ -705,6 +1109,137 @@ def plot_func(xs, func, label, filename_prefix, x_label=None, close=True, color=
 		plt.close()
 		plt.clf()
 
+def _add_fit(key, entry):
+	global _fits_changed
+	_get_fits()[key] = entry
+	if entry['params'] is not None:
+		_warm_starts[entry['doses']] = entry['params']
+	_fits_changed = True
+
+def _bootstrap_block(xs, replicates, params, cocktail, E_0, E_max, pct_inhibitions, block_size,
+		seed_sequence):
+	rng = np.random.default_rng(seed_sequence)
+	ys = np.column_stack([
+		np.median(values[rng.integers(len(values), size=(block_size, len(values)))], axis=1) \
+			if len(values) > 0 else np.full(block_size, np.nan) for values in replicates])
+
+	fits, _ = fit_log_logistic_batch(np.tile(xs, (block_size, 1)), ys, E_0, cache=False,
+		guesses=params, verify=False)
+	models = [Model([], [], cocktail, E_0, E_max, params=fit) for fit in fits]
+	return np.column_stack([fits, effective_concentrations(models, pct_inhibitions)])
+
+def _fit_log_logistic(xs, ys, d, methods, name, warm_start=None):
+	equation = lambda xs, b, c, e: log_logistic_model(xs, b, c, d, e)
+	jacobian = lambda xs, b, c, e: _get_log_logistic_jacobian(xs, b, c, d, e)
+
+	# a warm start gets one attempt with the first method before the usual data-driven start
+	guess = _get_log_logistic_guess(xs, ys, d)
+	attempts = [(method, guess) for method in methods]
+	if warm_start is not None:
+		attempts.insert(0, (methods[0], warm_start))
+
+	for method, guess in attempts:
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore', RuntimeWarning)
+			warnings.simplefilter('error', scipy.optimize.OptimizeWarning) # e.g. singular pcov
+			try:
+				popt, pcov = scipy.optimize.curve_fit(equation, xs, ys, p0=guess, jac=jacobian,
+					method=method)
+			except (RuntimeError, ValueError, scipy.optimize.OptimizeWarning) as error:
+				print(f'WARN: {name} fit with method {method} failed: {error}')
+				continue
+
+		if np.all(np.isfinite(popt)) and np.all(np.isfinite(pcov)) and popt[2] > 0:
+			return popt, pcov
+		print(f'WARN: {name} fit with method {method} did not converge to usable parameters')
+
+	return None, None
+
+# fractional inhibition of `model`'s drug alone at its dose in each combo solution, NaN for
+# solutions without it, e.g. controls
+def _get_bliss_inhibitions(model, xs):
+	doses = _get_drug_doses(xs, model.cocktail.drugs[0])
+
+	indexes = {}
+	for i, solution in enumerate(model.xs):
+		indexes.setdefault(solution.doses[0], i)
+
+	found = np.array([dose in indexes for dose in doses], dtype=bool)
+	missing = [dose for dose, dose_found in zip(doses, found) \
+		if dose is not None and not dose_found]
+	if missing:
+		print(f'WARNING: {len(missing)} doses, e.g. {missing[0]}, not found in '
+			f'{model.get_condition()}. Using modeled responses.')
+
+	max_, min_ = _get_survival_scales([model])
+	ys = np.array([model.ys[indexes[dose]] if dose_found else np.nan \
+		for dose, dose_found in zip(doses, found)], dtype=np.float64)
+	modeled = get_pct_survivals([model],
+		xs=[np.nan if dose is None else float(dose) for dose in doses])[0]
+
+	return 1 - np.where(found, (ys - min_) / (max_ - min_), modeled)
+
+# each combo solution's dose of `drug`, or None for solutions without it, e.g. controls
+def _get_drug_doses(xs, drug):
+	return [None if float(x) == 0 else {dose.drug: dose for dose in x.doses}.get(drug) for x in xs]
+
+# diagnostics are kept alongside the parameters; 'used' orders entries for LRU eviction
+def _get_fit_entry(doses_key, params, pcov, sse=None):
+	return {
+		'doses': doses_key,
+		'params': None if params is None else [float(param) for param in params],
+		'pcov': None if pcov is None else np.asarray(pcov).tolist(),
+		'sse': None if sse is None else float(sse),
+		'used': time(),
+	}
+
+# one key for the data and settings of a fit, and one for its doses alone, so fits of slightly
+# different data at the same doses (e.g. with another replicate plate) can be warm started
+def _get_fit_keys(xs, ys, d, options):
+	xs = [float(x) for x in xs]
+	return (util.get_digest(xs=xs, ys=[float(y) for y in ys], d=d, options=options),
+		util.get_digest(xs=xs, d=d))
+
+def _get_fits():
+	global _fitfile, _fits, _warm_starts
+	if _fits is None:
+		if _fitfile is None:
+			_fitfile = util.get_fit_cachefile(version=FIT_VERSION)
+		_fits = util.load_fits(_fitfile)
+		_warm_starts = {}
+		for fit in sorted(_fits.values(), key=lambda fit: fit['used']):
+			if fit['params'] is not None:
+				_warm_starts[fit['doses']] = fit['params']
+		atexit.register(_save_fits)
+	return _fits
+
+# c from the floor of the data, e from the median nonzero dose, and a moderate positive slope
+def _get_log_logistic_guess(xs, ys, d):
+	nonzero_xs = xs[xs > 0]
+	e = np.median(nonzero_xs) if len(nonzero_xs) > 0 else 1.0
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning) # ys without any valid points
+		min_y = np.nanmin(ys)
+	c = min_y if min_y < d else d - 1
+	return [1.0, c, e]
+
+def _get_log_logistic_jacobian(xs, b, c, d, e):
+	with np.errstate(divide='ignore', invalid='ignore'):
+		log_xs_e = np.where(xs > 0, np.log(np.where(xs > 0, xs, 1) / e), 0)
+	u = np.where(xs > 0, np.exp(b * log_xs_e), 0) # (x/e)^b, which is 0 at x=0 for b > 0
+	denominator = 1 + u
+	return np.stack([
+		-(d - c) * u * log_xs_e / denominator**2, # ∂f/∂b
+		u / denominator * np.ones_like(xs), # ∂f/∂c
+		(d - c) * u * (b / e) / denominator**2, # ∂f/∂e
+	], axis=-1)
+
+# the interval exp(log(estimate) ± z * SE(log(estimate))), with SE by the delta method
+def _get_log_scale_ci(estimates, variances, alpha):
+	log_standard_errors = np.sqrt(variances) / estimates
+	z = scipy.stats.norm.ppf(1 - alpha/2)
+	return estimates * np.exp(-z * log_standard_errors), estimates * np.exp(z * log_standard_errors)
+
 def _get_model(filename, debug=1):
 	xs, ys = [], []
 
@@ -718,12 +1253,61 @@ def _get_model(filename, debug=1):
 		model.chart()
 	return model
 
+# b, c, d, e, and the survival scale of each model, shaped to broadcast against `ndim` more axes
+def _get_model_params(models, ndim):
+	params = np.array([
+		(model.b, model.c, model.E_0, model.e, model.E_0, model.get_absolute_E_max()) \
+			if model.b else (np.nan,) * 6 for model in models], dtype=np.float64).reshape(-1, 6)
+	return params.T.reshape((6, -1) + (1,) * ndim)
+
 def _get_neo_model(debug=1):
 	global _neo_model
 	if _neo_model == None:
 		_neo_model = _get_model(os.path.join(util.get_here(), 'examples/neo_data.csv'), debug)
 	return _neo_model
 
+# the most recent successful fit of each set of doses, indexed when the fits are loaded
+def _get_warm_starts():
+	_get_fits()
+	return _warm_starts
+
+# fractional inhibition of every solution of every combo model, for each replicate in
+# `datapoints` or else each model's ys; one row per solution, NaN-padded by replicate
+def _get_observed_inhibitions(models_combo, datapoints=None):
+	xs = [x for model_combo in models_combo for x in model_combo.xs]
+	if datapoints is None:
+		responses = [[y] for model_combo in models_combo for y in model_combo.ys]
+	else:
+		responses = [list(datapoints[x]) for x in xs]
+	width = max([len(values) for values in responses], default=1)
+	responses = np.array([values + [np.nan] * (width - len(values)) for values in responses],
+		dtype=np.float64).reshape(len(xs), width)
+
+	max_, min_ = _get_survival_scales(
+		[model_combo for model_combo in models_combo for _ in model_combo.xs])
+	return xs, 1 - (responses - min_[:, np.newaxis]) / (max_ - min_)[:, np.newaxis]
+
+# E_0 and absolute E_max of each model, which need no fit if E_max is known
+def _get_survival_scales(models):
+	scales = np.array([(model.E_0, model.get_absolute_E_max()) for model in models],
+		dtype=np.float64).reshape(-1, 2)
+	return scales[:, 0], scales[:, 1]
+
+def _save_fits():
+	global _fits_changed
+	if _fits_changed:
+		util.save_fits(_fitfile, _fits, int(util.get_config('fit_cache_size', 1024)))
+		_fits_changed = False
+
+# 'used' orders entries for LRU eviction, so it's saved at exit like a new fit
+def _use_fit(key):
+	global _fits_changed
+	fit = _get_fits()[key]
+	fit['used'] = time()
+	if fit['params'] is not None: # now the most recent fit of its doses
+		_warm_starts[fit['doses']] = fit['params']
+	_fits_changed = True
+
 #
 # main
 #
@@ -1,11 +1,13 @@
 import argparse
 import cv2 as cv
 from skimage import feature
+import functools
 import imageio
 import math
 import numpy as np
 import os
 import sys
+import tifffile
 from time import time
 import warnings
 
@@ -22,6 +24,9 @@ if base_log_dir == '/path/to/log/dir':
 	))
 
 LOG_DIR = f'{base_log_dir}/imageops'
+MASK_STEPS_VERSION = 1 # increment whenever the fish outline steps change, invalidating cached masks
+SCORE_VERSION = 1 # increment whenever score changes, invalidating stored raw scores
+ROI_LEVELS = 3 # how many pyramid levels coarser --roi locates the fish at
 try:
 	os.makedirs(LOG_DIR, exist_ok=True)
 except OSError as ose:
@@ -81,8 +86,18 @@ def get_contours_by_area(img, threshold=-1, lower=0, upper=2**32):
 	areas = np.array([cv.contourArea(contour) for contour in contours])
 	return [contour for contour, area in zip(contours, areas) if area > lower and area < upper]
 
+def get_bounding_box(img, margin=0):
+	height, width = img.shape[:2]
+	rows, cols = np.nonzero(np.any(img, axis=1))[0], np.nonzero(np.any(img, axis=0))[0]
+	if len(rows) == 0: # nothing to bound: fall back to the whole image
+		return slice(0, height), slice(0, width)
+	return (
+		slice(max(rows[0] - margin, 0), min(rows[-1] + margin + 1, height)),
+		slice(max(cols[0] - margin, 0), min(cols[-1] + margin + 1, width)),
+	)
+
 def get_fish_mask(bf_img, fl_img, particles=True, silent=True, verbose=False, v_file_prefix='',
-		mask_filename=None, subtr_img=[]):
+		mask_filename=None, subtr_img=[], roi=False, mask_cachefile=None, level=0):
 	show(bf_img, verbose or not silent, v_file_prefix=v_file_prefix)
 	show(fl_img, verbose or not silent, v_file_prefix=v_file_prefix)
 
@@ -90,69 +105,116 @@ def get_fish_mask(bf_img, fl_img, particles=True, silent=True, verbose=False, v_
 		fl_img = subtract(fl_img, subtr_img, scale=True)
 		show(fl_img, verbose or not silent, v_file_prefix=v_file_prefix)
 
+	mask_img = None
+
 	if mask_filename and os.path.isfile(mask_filename):
 		with warnings.catch_warnings():
 			warnings.simplefilter("ignore", UserWarning)
 			mask_img = read(mask_filename, np.uint8)
 			show(mask_img, verbose, v_file_prefix=v_file_prefix)
-
-		if particles:
-			steps = (
-				lambda img_i: apply_mask(fl_img, mask_img),
-				lambda img_i: circle_local_maxima(
-					img_i, count=10, discard=5, min_pct=0.05, radius=8),
-			)
-		else:
-			steps = (
-				lambda img_i: mask_img,
-			)
-	else:
-		steps = (
+	elif mask_cachefile and os.path.isfile(mask_cachefile):
+		mask_img = load_mask(mask_cachefile)
+		show(mask_img, verbose, v_file_prefix=v_file_prefix)
+
+	if mask_img is None:
+		# the outline only needs coarse shape, so it may be found on a downsampled pyramid level,
+		# with kernel sizes scaled by 2^-level and contour areas by 4^-level
+		bf_img_level = _downsample_min(bf_img, level)
+		erosion_size, close_size, dilate_size = (_scale_size(size, level) for size in (4, 6, 5))
+		min_area, max_area = 2**15 // 4**level, 2**19 // 4**level
+
+		candidate_steps = (
 			rescale_brightness,
 			lambda img_i: binarize(img_i, threshold=2**14),
 			lambda img_i: apply_mask(
-				img_i, get_size_mask(bf_img, erosions=10, threshold=2**12, lower=2**15,
-					verbose=verbose, v_file_prefix=v_file_prefix)),
-			lambda img_i: close(img_i, size=6, iterations=16),
-			lambda img_i: dilate(img_i, size=5, iterations=6),
+				img_i, get_size_mask(bf_img_level, erosions=10, threshold=2**12, lower=min_area,
+					verbose=verbose, v_file_prefix=v_file_prefix, erosion_size=erosion_size)),
+		)
+		outline_steps = (
+			lambda img_i: close(img_i, size=close_size, iterations=16),
+			lambda img_i: dilate(img_i, size=dilate_size, iterations=6),
 			lambda img_i: get_size_mask(
-				img_i, erosions=4, threshold=-1, lower=2**15, upper=2**19, verbose=verbose,
-				v_file_prefix=v_file_prefix),
+				img_i, erosions=4, threshold=-1, lower=min_area, upper=max_area, verbose=verbose,
+				v_file_prefix=v_file_prefix, erosion_size=erosion_size),
 			invert,
 		)
-		if particles:
-			steps = (
-				*steps,
-				lambda img_i: apply_mask(fl_img, img_i),
-				lambda img_i: circle_local_maxima(
-					img_i, count=10, discard=5, min_pct=0.05, radius=8),
-			)
-
-	mask = _get_mask(bf_img, steps, verbose, v_file_prefix=v_file_prefix)
+
+		if roi:
+			# the fish is the cluster of candidate pixels, as the closing and dilation would join
+			# them, holding the most of them, so scattered debris doesn't widen the crop; the
+			# outline steps can't grow the candidate pixels further than the sum of their kernel
+			# reaches, so within this margin the fish's outline is the same as on the full frame
+			candidates = _get_mask(bf_img_level, candidate_steps, verbose,
+				v_file_prefix=v_file_prefix)
+			bounds = _get_cluster_bounds(candidates, reach=close_size*16 + dilate_size*6,
+				margin=close_size*16 + dilate_size*6 + erosion_size*4 + 1)
+			mask_img = _get_mask_roi(bf_img_level, bounds,
+				(lambda img_i: candidates[bounds], *outline_steps), verbose, v_file_prefix)
+		else:
+			mask_img = _get_mask(bf_img_level, (*candidate_steps, *outline_steps), verbose,
+				v_file_prefix=v_file_prefix)
+
+		if level > 0: # nearest-neighbour upsampling, back to the original dimensions
+			factor = 2**level
+			mask_img = mask_img.repeat(factor, axis=0).repeat(factor, axis=1) \
+				[:bf_img.shape[0], :bf_img.shape[1]]
+
+		if mask_cachefile:
+			save_mask(mask_cachefile, mask_img)
+
+	if particles:
+		# puncta are only searched for within the mask, plus the reach of the local maxima search
+		bounds = get_bounding_box(mask_img, margin=8 + 1) if roi else None
+		fl_img_roi = fl_img if bounds is None else fl_img[bounds]
+		mask_img_roi = mask_img if bounds is None else mask_img[bounds]
+		steps = (
+			lambda img_i: apply_mask(fl_img_roi, mask_img_roi),
+			lambda img_i: circle_local_maxima(
+				img_i, count=10, discard=5, min_pct=0.05, radius=8),
+		)
+		mask = _get_mask_roi(bf_img, bounds, steps, verbose, v_file_prefix)
+	else:
+		mask = _get_mask(bf_img, (lambda img_i: mask_img,), verbose, v_file_prefix=v_file_prefix)
+
 	show(apply_mask(fl_img, mask), not verbose and not silent, v_file_prefix=v_file_prefix)
 	return mask
 
+def get_mask_agreement(mask_a, mask_b):
+	# intersection over union of the foregrounds, 1 if both are empty
+	foreground_a, foreground_b = mask_a == 255, mask_b == 255
+	union = np.count_nonzero(foreground_a | foreground_b)
+	return np.count_nonzero(foreground_a & foreground_b) / union if union > 0 else 1.0
+
 def get_size_mask(img, erosions=0, threshold=2**7, lower=0, upper=2**32, verbose=False,
-		v_file_prefix=''):
+		v_file_prefix='', erosion_size=4):
 	contours = get_contours_by_area(img, threshold, lower, upper)
 	steps = (
 		lambda img_i: cv.drawContours(
 			np.ones(img_i.shape, dtype=np.uint8)*255, contours, -1, (0,255,0), cv.FILLED),
-		lambda img_i: erode(img_i, size=4, iterations=erosions),
+		lambda img_i: erode(img_i, size=erosion_size, iterations=erosions),
 	)
 	return _get_mask(img, steps, verbose, v_file_prefix=v_file_prefix)
 
 def invert(img):
 	return np.subtract(_get_bit_depth(img)[1], img)
 
+def load_mask(filename):
+	with np.load(filename) as data:
+		height, width = data['shape']
+		bits = np.unpackbits(data['bits'], count=height*width)
+	return (bits.reshape((height, width)) * 255).astype(np.uint8)
+
 def read(filename, target_bit_depth, channel=-1):
-	img = imageio.imread(filename)
-	if channel >= 0:
-		img = img[:,:,channel]
+	try:
+		img = _read_tiff(filename, channel)
+	except tifffile.TiffFileError: # not a tiff, so fall back to a general-purpose decoder
+		img = imageio.imread(filename)
+		if channel >= 0:
+			img = img[:,:,channel]
 
 	bit_depth = _get_bit_depth(img)
 	if bit_depth[0] != target_bit_depth:
-		img = (img * (np.iinfo(target_bit_depth).max / bit_depth[1])).astype(target_bit_depth)
+		img = _convert_bit_depth(img, bit_depth[1], target_bit_depth)
 
 	return img
 
@@ -163,21 +225,31 @@ def rescale_brightness(img):
 def resize(img, factor):
 	return cv.resize(img, None, fx=factor, fy=factor)
 
+def save_mask(filename, mask):
+	temp_filename = f'{filename}.{os.getpid()}.tmp'
+	with open(temp_filename, 'wb') as f: # write then rename, so readers never see partial files
+		np.savez_compressed(f, bits=np.packbits(mask == 255), shape=mask.shape)
+	os.replace(temp_filename, filename)
+
 def score(img, count=10, radius=8, threshold_pct=0.05):
 	coordinates = _get_local_maxima(img, count=count, spacing=radius)
+	if len(coordinates) == 0:
+		return 0
+
+	# one row of disk neighbourhood coordinates per peak
+	offsets_y, offsets_x = _get_disk_offsets(radius)
+	ys = coordinates[:, :1] + offsets_y
+	xs = coordinates[:, 1:] + offsets_x
+
 	height, width = img.shape
-	total = 0
+	in_bounds = (ys >= 0) & (ys < height) & (xs >= 0) & (xs < width)
+	points = img[ys.clip(0, height - 1), xs.clip(0, width - 1)].astype(np.int64)
+	points[~in_bounds] = -1 # never selected: pixel values are nonnegative
 
-	for coord_y, coord_x in coordinates:
-		x_min, x_max = max(coord_x - radius, 0), min(coord_x + radius, width) # bounding box
-		y_min, y_max = max(coord_y - radius, 0), min(coord_y + radius, height)#
-		points = []
-		for x in range(x_min, x_max + 1):
-			for y in range(y_min, y_max + 1):
-				if (x - coord_x)**2 + (y - coord_y)**2 > radius**2: # Pythagorean theorem
-					continue
-				points.append(img[y][x])
-		relevant_points = sorted(points, reverse=True)[:int(len(points)*threshold_pct)]
+	tops = (in_bounds.sum(axis=1) * threshold_pct).astype(int)
+	total = 0
+	for top in np.unique(tops[tops > 0]): # peaks away from the borders all share one value
+		relevant_points = np.partition(points[tops == top], -top, axis=1)[:, -top:]
 		total += np.sum(relevant_points, dtype=np.int64)
 	return total
 
@@ -204,10 +276,57 @@ def _aspect_is_between(contour, upper, lower):
 	aspect_ratio = major / minor
 	return (aspect_ratio < upper) and (aspect_ratio > lower)
 
+def _convert_bit_depth(img, source_max, target_bit_depth):
+	target_max = np.iinfo(target_bit_depth).max
+	if target_max >= source_max and target_max % source_max == 0: # e.g. 8 to 16 bits: exact
+		return img.astype(target_bit_depth) * target_bit_depth(target_max // source_max)
+	# otherwise scale in integer arithmetic, wide enough that it cannot overflow
+	return (img.astype(np.uint64) * target_max // source_max).astype(target_bit_depth)
+
+def _downsample_min(img, level):
+	# each pixel takes the darkest of the block it covers, as dark pixels seed the fish outline
+	if level == 0:
+		return img
+	factor = 2**level
+	height, width = -(-img.shape[0] // factor), -(-img.shape[1] // factor) # rounding up
+	padded = np.pad(img, ((0, height*factor - img.shape[0]), (0, width*factor - img.shape[1])),
+		mode='edge')
+	return padded.reshape(height, factor, width, factor).min(axis=(1, 3))
+
 def _get_bit_depth(img):
 	types = [(itype, np.iinfo(itype).max) for itype in [np.uint8, np.uint16, np.int32]]
 	return types[np.digitize(img.max(), [itype[1] for itype in types], right=True)]
 
+# the bounding box of the cluster holding the most foreground pixels, plus `margin`, where
+# pixels are clustered on a 2^ROI_LEVELS coarser grid by growing each by `reach`, so any within
+# twice the reach of each other (as the outline steps could join them) are in the same cluster
+def _get_cluster_bounds(img, reach, margin=0):
+	factor = 2**ROI_LEVELS
+	height, width = -(-img.shape[0] // factor), -(-img.shape[1] // factor) # rounding up
+	padded = np.pad(img > 0, ((0, height*factor - img.shape[0]), (0, width*factor - img.shape[1])))
+	counts = padded.reshape(height, factor, width, factor).sum(axis=(1, 3))
+
+	occupied = counts > 0
+	# one more cell than the reach, as pixels may sit anywhere within their cells
+	clusters = dilate(occupied.astype(np.uint8), size=-(-reach // factor) + 1)
+	cluster_count, labels = cv.connectedComponents(clusters)
+	weights = np.bincount(labels.ravel(), weights=counts.ravel(), minlength=cluster_count)
+	weights[0] = 0 # the background
+	if not np.any(weights):
+		return get_bounding_box(img) # nothing to bound: the whole image
+
+	rows, cols = get_bounding_box((labels == np.argmax(weights)) & occupied)
+	return (
+		slice(max(rows.start*factor - margin, 0), min(rows.stop*factor + margin, img.shape[0])),
+		slice(max(cols.start*factor - margin, 0), min(cols.stop*factor + margin, img.shape[1])),
+	)
+
+@functools.lru_cache
+def _get_disk_offsets(radius):
+	offsets_y, offsets_x = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+	in_disk = offsets_x**2 + offsets_y**2 <= radius**2 # Pythagorean theorem
+	return offsets_y[in_disk], offsets_x[in_disk]
+
 def _get_kernel(size):
 	return cv.getStructuringElement(cv.MORPH_ELLIPSE, (size*2 + 1, size*2 + 1), (size, size))
 
@@ -223,25 +342,103 @@ def _get_mask(img, steps, verbose=False, v_file_prefix=''):
 	show(apply_mask(img, img_i), verbose, v_file_prefix=v_file_prefix)
 	return img_i
 
+def _get_mask_roi(img, bounds, steps, verbose=False, v_file_prefix=''):
+	if bounds is None:
+		return _get_mask(img, steps, verbose, v_file_prefix=v_file_prefix)
+
+	mask_roi = _get_mask(img[bounds], steps, verbose, v_file_prefix=v_file_prefix)
+	mask = np.zeros(img.shape, dtype=mask_roi.dtype)
+	mask[bounds] = mask_roi
+	return mask
+
+def _read_tiff(filename, channel=-1):
+	with tifffile.TiffFile(filename) as tif:
+		page = tif.pages.first
+		if page.is_memmappable: # uncompressed and contiguous: only touch the channel's bytes
+			img = tifffile.memmap(filename, page=0, mode='r')
+		else: # samples are interleaved within each compressed strip, so decode the whole page
+			img = page.asarray()
+
+		if channel >= 0 and 'S' in page.axes:
+			img = np.moveaxis(img, page.axes.index('S'), -1)[..., channel]
+		return np.ascontiguousarray(img) # copies out of the memory map, or drops other channels
+
+def _scale_size(size, level):
+	return max(1, round(size / 2**level))
+
 def _test():
 	assert _get_bit_depth(np.array([1, 2, 3, 4, 5])) == (np.uint8, 255)
 	assert _get_bit_depth(np.array([1, 2, 3, 4, 255])) == (np.uint8, 255)
 	assert _get_bit_depth(np.array([1, 2, 3, 4, 256])) == (np.uint16, 65_535)
 	assert _get_bit_depth(np.array([1, 2, 3, 4, 65_536])) == (np.int32, 2_147_483_647)
 
+	assert _convert_bit_depth(np.array([0, 1, 255], dtype=np.uint8), 255, np.uint16).tolist() == \
+		[0, 257, 65_535]
+	assert _convert_bit_depth(np.array([0, 257, 65_535], dtype=np.uint16), 65_535, np.uint8) \
+		.tolist() == [0, 1, 255]
+
+	assert get_bounding_box(np.array([[0, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 0]])) == \
+		(slice(1, 2), slice(1, 2))
+	assert get_bounding_box(np.array([[0, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 0]]), margin=1) == \
+		(slice(0, 3), slice(0, 3))
+	assert get_bounding_box(np.zeros((3, 4))) == (slice(0, 3), slice(0, 4))
+
+	img = np.zeros((64, 64), dtype=np.uint8)
+	img[8:24:2, 8:24:2] = 255 # the fish, as scattered candidate pixels
+	img[60, 60] = 255 # debris, farther away than the reach
+	assert _get_cluster_bounds(img, reach=8) == (slice(8, 24), slice(8, 24))
+	assert _get_cluster_bounds(img, reach=8, margin=4) == (slice(4, 28), slice(4, 28))
+	assert _get_cluster_bounds(np.zeros((3, 4)), reach=8) == (slice(0, 3), slice(0, 4))
+	img = np.zeros((128, 128), dtype=np.uint8)
+	img[40, 40] = img[40, 60] = img[40, 62] = 255 # closer than the reach, but cells apart
+	assert _get_cluster_bounds(img, reach=16) == (slice(40, 48), slice(40, 64))
+
+	assert get_mask_agreement(np.array([0, 255, 255, 0]), np.array([0, 255, 0, 255])) == 1/3
+	assert get_mask_agreement(np.zeros(4), np.zeros(4)) == 1
+	assert _downsample_min(np.arange(15).reshape(3, 5), 1).tolist() == [[0, 2, 4], [10, 12, 14]]
+
+	mask = np.zeros((5, 7), dtype=np.uint8)
+	mask[1:3, 2:6] = 255
+	mask_filename = f'{LOG_DIR}/_test_mask.npz'
+	save_mask(mask_filename, mask)
+	assert np.array_equal(load_mask(mask_filename), mask)
+	assert load_mask(mask_filename).dtype == np.uint8
+	os.remove(mask_filename)
+
+	# values as calculated by walking each disk pixel by pixel
+	example_prefix = os.path.join(util.get_here(), 'examples', 'example')
+	with warnings.catch_warnings():
+		warnings.simplefilter("ignore", UserWarning)
+		assert score(read(f'{example_prefix}_XY01_CH1.tif', np.uint16, 1)) == 5_836_917
+		assert score(read(f'{example_prefix}_XY59_CH1.tif', np.uint16, 1)) == 940_162
+		assert np.array_equal(read(f'{example_prefix}_XY01_CH1.tif', np.uint16, 1),
+			read(f'{example_prefix}_XY01_CH1.tif', np.uint16)[:,:,1])
+
+		# as a brightfield, this has groups of candidates closer than the outline steps' reach
+		fl_img = read(f'{example_prefix}_XY38_CH1.tif', np.uint16, 1)
+		assert np.array_equal(get_fish_mask(invert(fl_img), fl_img, particles=False, roi=True),
+			get_fish_mask(invert(fl_img), fl_img, particles=False))
+	assert score(np.zeros((32, 32), dtype=np.uint16)) == 0
+
 #
 # main
 #
 
-def main(imagefiles, debug=1, logfile_prefix='imageops', particles=True):
+def main(imagefiles, debug=1, logfile_prefix='imageops', particles=True, roi=False, level=0):
 	for bf_filename in imagefiles:
 		fl_filename = bf_filename.replace('CH4', 'CH1')
 		with warnings.catch_warnings():
 			warnings.simplefilter("ignore", UserWarning)
 			bf_img = read(bf_filename, np.uint16)
 			fl_img = None if not particles else read(fl_filename, np.uint16, 1)
-		get_fish_mask(bf_img, fl_img, particles=particles, silent=debug<1, verbose=debug>1,
-			v_file_prefix=logfile_prefix, mask_filename=bf_filename.replace('CH4', 'mask'))
+		mask = get_fish_mask(bf_img, fl_img, particles=particles, silent=debug<1, verbose=debug>1,
+			v_file_prefix=logfile_prefix, mask_filename=bf_filename.replace('CH4', 'mask'), roi=roi,
+			level=level)
+		if level > 0: # report how closely the downsampled outline matches the full-res one
+			full_mask = get_fish_mask(bf_img, fl_img, particles=particles, roi=roi,
+				mask_filename=bf_filename.replace('CH4', 'mask'))
+			print(f'{bf_filename}: level {level} mask agreement (IoU) with full resolution: '
+				f'{get_mask_agreement(mask, full_mask):.4f}')
 
 if __name__ == '__main__':
 	_test()
@@ -257,6 +454,16 @@ if __name__ == '__main__':
 		action='store_true',
 		help=('If present, the resulting mask will obscure everything except the bright particles '
 			'on the fish in the given images. Otherwise the whole fish will be shown.'))
+	parser.add_argument('--roi',
+		action='store_true',
+		help=('If present, masking steps after the initial brightfield thresholding are restricted '
+			'to the bounding box of the fish.'))
+	parser.add_argument('-l', '--level',
+		default=0,
+		type=int,
+		help=('Pyramid level at which to find the fish outline, each level halving the resolution. '
+			'The resulting mask is upsampled, and its agreement with a full-resolution mask '
+			'reported.'))
 	parser.add_argument('-d', '--debug',
 		action='count',
 		default=1,
@@ -1,7 +1,5 @@
 import argparse
-import json
 import numpy as np
-import os
 import seaborn as sns
 import sys
 import warnings
@@ -46,27 +44,25 @@ def log(results):
 def main(imagefiles, cap=-1, chartfile=None, checkerboard=False, conversions=[], debug=0,
 		platefile=None, plate_control=['B'], plate_info=None,
 		plate_positive_control=[], treatment_platefile=None, absolute_chart=False, silent=False,
-		talk=False):
-	hashfile = util.get_inputs_hashfile(imagefiles=imagefiles, cap=cap, platefile=platefile,
-		plate_control=plate_control)
+		talk=False, workers=1, roi=False, mask_cache=True, cache_contents=False,
+		stream=False, mask_level=0):
+	# raw scores don't depend on grouping or normalization, so changing those never re-quantifies;
+	# each row is checked against its own image's files, so every input set shares one store
+	scorefile = util.get_scorefile(image_type=InfectionImage.__name__,
+		channels=(InfectionImage.channel, InfectionImage.channel_subtr),
+		particles=InfectionImage.particles, mask_level=mask_level, roi=roi,
+		version=(imageops.MASK_STEPS_VERSION, imageops.SCORE_VERSION))
 
 	if talk:
 		sns.set_context('talk')
 
-	if debug == 0 and os.path.exists(hashfile):
-		with open(hashfile, 'r') as f: # read cached results
-			results = json.load(f)
-
-		for group, relevant_values in results.items():
-			if not silent:
-				with warnings.catch_warnings():
-					warnings.simplefilter('ignore', RuntimeWarning)
-					print(group, np.nanmedian(relevant_values), relevant_values)
-	else:
-		results = quantify_infection(imagefiles=imagefiles, cap=cap, debug=debug,
-			platefile=platefile, plate_control=plate_control, silent=False)
-		with open(hashfile, 'w') as f: # cache results for reuse
-			json.dump(results, f, ensure_ascii=False)
+	# raw image values are reused per image, for as long as that image's files are unchanged
+	scores = util.load_scores(scorefile) if debug == 0 else {} # with debug, recompute everything
+	results = quantify_infection(imagefiles=imagefiles, cap=cap, debug=debug, platefile=platefile,
+		plate_control=plate_control, silent=False, workers=workers, roi=roi,
+		mask_cache=mask_cache, cache=scores, cache_contents=cache_contents, stream=stream,
+		mask_level=mask_level)
+	util.save_scores(scorefile, scores)
 
 	if chartfile:
 		analyze.chart(log(results), chartfile)
@@ -89,14 +85,16 @@ def main(imagefiles, cap=-1, chartfile=None, checkerboard=False, conversions=[],
 		max_val=max_result)
 
 def quantify_infection(imagefiles, cap=-1, debug=0, platefile=None, plate_control=['B'],
-		silent=False):
+		silent=False, workers=1, roi=False, mask_cache=True, cache=None, cache_contents=False,
+		stream=False, mask_level=0):
 	results = {}
 
 	schematic = analyze.get_schematic(platefile, len(imagefiles))
 	groups = list(dict.fromkeys(schematic))# deduplicated copy of `schematic`
 
-	images = [InfectionImage(filename, group, debug) \
+	images = [InfectionImage(filename, group, debug, roi, mask_cache, mask_level) \
 		for filename, group in zip(imagefiles, schematic)]
+	analyze.calculate_raw_values(images, workers, cache, cache_contents, stream)
 
 	for group in groups:
 		relevant_values = [absolute.get_absolute_value(img) for img in images if img.group == group]
@@ -165,6 +163,11 @@ if __name__ == '__main__':
 		help=('If present, a plate graphic will be generated with absolute (rather than relative) '
 			'brightness values.'))
 
+	parser.add_argument('--cache-contents',
+		action='store_true',
+		help=('If present, cached image values are only reused if the contents of the image files '
+			'are unchanged. Otherwise, file sizes and modification times are compared.'))
+
 	parser.add_argument('--talk',
 		action='store_true',
 		help=('If present, images will be generated with the Seaborn "talk" context.'))
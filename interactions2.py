@@ -1,7 +1,8 @@
+from concurrent.futures import ProcessPoolExecutor
+import functools
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-import scipy.optimize
 import scipy.stats
 import seaborn as sns
 from time import time
@@ -11,59 +12,25 @@ import util
 
 LOG_DIR = f'{util.get_config("log_dir")}/interactions2'
 
-_rng = np.random.default_rng()
+SAMPLING_BLOCK_SIZE = 50 # iterations per independent random stream; fixed, unlike worker counts
 
-def fit_model_with_noise(model_function, gamma_guess_0, doses_a, doses_b, doses_a_ab, doses_b_ab,
-		est_response_covarmat_a, est_response_covarmat_b, est_true_responses_a,
-		est_true_responses_b, observed_responses_ab):
-	noises_a = dict(zip(doses_a,
-		_rng.multivariate_normal(np.zeros(len(doses_a)), est_response_covarmat_a)))
-	noises_b = dict(zip(doses_b,
-		_rng.multivariate_normal(np.zeros(len(doses_b)), est_response_covarmat_b)))
+# every model is linear in gamma, so all noise realizations (one per row of the noises) can be fit
+# at once, in closed form: `solver` is the pseudo-inverse of a design matrix, or several stacked,
+# and each row of the result is the least-squares gamma of that realization
+def fit_models_with_noise(solver, dose_idxs_a, dose_idxs_b, est_true_responses_a,
+		est_true_responses_b, observed_responses_ab, noises_a, noises_b):
+	return _get_bliss_excesses(dose_idxs_a, dose_idxs_b, est_true_responses_a,
+		est_true_responses_b, observed_responses_ab, noises_a, noises_b) @ solver.T
 
-	est_true_responses_a = dict(zip(doses_a, est_true_responses_a))
-	est_true_responses_b = dict(zip(doses_b, est_true_responses_b))
-
-	est_theoretical_responses_ab = []
-
-	for dose_a, dose_b in zip(doses_a_ab, doses_b_ab):
-		# Zhao 2014, Eq. 5
-		est_theoretical_responses_ab.append(
-			est_true_responses_a[dose_a] + est_true_responses_b[dose_b] \
-			- est_true_responses_a[dose_a]*est_true_responses_b[dose_b] \
-			+ noises_a[dose_a] + noises_b[dose_b] \
-			- noises_a[dose_a]*noises_b[dose_b])
+def get_design_matrix(doses_a_ab, doses_b_ab, model_size):
+	if model_size not in (1, 4, 6):
+		raise ValueError(f'Model with {model_size} parameters is not defined')
 
 	doses_a_ab = np.array([float(dose_a) for dose_a in doses_a_ab])
 	doses_b_ab = np.array([float(dose_b) for dose_b in doses_b_ab])
 
-	est_theoretical_responses_ab = np.array(est_theoretical_responses_ab)
-
-	return scipy.optimize.least_squares(model_function, gamma_guess_0,
-		args=(doses_a_ab, doses_b_ab, observed_responses_ab, est_theoretical_responses_ab))
-
-def model_1_param(gamma, doses_a, doses_b, observed_responses_ab, theoretical_responses_ab):
-	gamma_0 = gamma[0]
-
-	residuals = gamma_0 - observed_responses_ab + theoretical_responses_ab
-
-	return residuals
-
-def model_4_param(gamma, doses_a, doses_b, observed_responses_ab, theoretical_responses_ab):
-	gamma_0, gamma_1, gamma_2, gamma_3 = gamma
-
-	residuals = gamma_0 + gamma_1*doses_a + gamma_2*doses_b + gamma_3*doses_a*doses_b \
-		- observed_responses_ab + theoretical_responses_ab
-
-	return residuals
-
-def model_6_param(gamma, doses_a, doses_b, observed_responses_ab, theoretical_responses_ab):
-	gamma_0, gamma_1, gamma_2, gamma_3, gamma_4, gamma_5 = gamma
-
-	residuals = gamma_0 + gamma_1*doses_a + gamma_2*doses_b + gamma_3*doses_a*doses_b \
-		+ gamma_4*doses_a**2 + gamma_5*doses_b**2 - observed_responses_ab + theoretical_responses_ab
-
-	return residuals
+	return np.column_stack([np.ones_like(doses_a_ab), doses_a_ab, doses_b_ab,
+		doses_a_ab * doses_b_ab, doses_a_ab**2, doses_b_ab**2])[:, :model_size]
 
 # convert values to % inhibition
 def normalize(values, maximum=100, minimum=0):
@@ -71,12 +38,14 @@ def normalize(values, maximum=100, minimum=0):
 
 def plot_heatmap(name_a, name_b, units_a, units_b, doses_a, doses_b, responses_a, responses_b,
 		doses_a_ab, doses_b_ab, responses_ab, I_estimates, I_ci_his, I_ci_los, model_size,
-		file_name_context=None):
+		file_name_context=None, alpha=None):
 	label_a = f'{name_a} Concentration ({units_a})'
 	label_b = f'{name_b} Concentration ({units_a})'
 
 	if file_name_context:
 		file_name_context += '_'
+	alpha_context = '' if alpha is None else f'_alpha-{alpha}'
+	alpha_label = '' if alpha is None else f', α = {alpha}'
 
 	dose_response_dict = {x: y for x, y in zip(doses_a, responses_a)}
 	dose_response_dict.update({x: y for x, y in zip(doses_b, responses_b)})
@@ -133,21 +102,22 @@ def plot_heatmap(name_a, name_b, units_a, units_b, doses_a, doses_b, responses_a
 	ax.collections[0].colorbar.set_ticklabels(
 		['-1 (Antagonism)', '0 (Additivity)', '+1 (Synergy)'])
 	ax.invert_yaxis()
-	plt.title(f'{name_a} vs. {name_b}: Bliss Ixn ({model_size}-param)')
+	plt.title(f'{name_a} vs. {name_b}: Bliss Ixn ({model_size}-param{alpha_label})')
 	plt.tight_layout()
 	uniq_str = str(int(time() * 1000) % 1_620_000_000_000)
-	plt.savefig(
-		f'{LOG_DIR}/{name_a}-{name_b}_{file_name_context}bliss_{model_size}-param_{uniq_str}.png'
-	)
+	plt.savefig(f'{LOG_DIR}/{name_a}-{name_b}_{file_name_context}bliss_{model_size}-param'
+		f'{alpha_context}_{uniq_str}.png')
 	plt.clf()
 
-def print_gamma_table(gammas, gamma_ci_his, gamma_ci_los, model_size):
+def print_gamma_table(gammas, gamma_ci_his, gamma_ci_los, model_size, alpha=None):
 	parameters = ['γ₀', 'γ₁', 'γ₂', 'γ₃', 'γ₄', 'γ₅']
 	parameters = parameters[:model_size] # trim to appropriate size
 	variables = ['', 'a', 'b', 'ab', 'a²', 'b²']
 	variables = variables[:model_size] # trim to appropriate size
 
 	print('Model: I =', ' + '.join([param + var for param, var in zip(parameters, variables)]))
+	if alpha is not None:
+		print(f'CIs at α = {alpha}')
 
 	data = pd.DataFrame({
 		'Variable': variables,
@@ -175,17 +145,28 @@ def print_mean(doses_a, doses_b, responses_a, responses_b, doses_a_ab, doses_b_a
 
 	print('Mean interaction score:', np.nanmean(interaction_scores))
 
-# as per formulas in Zhao 2014, https://doi.org/10.1177/1087057114521867
 def response_surface(doses_a, responses_all_a, doses_b, responses_all_b, doses_a_ab, doses_b_ab,
 		responses_all_ab, positive_control, sampling_iterations=1000, sample_size=20, model_size=4,
-		alpha=0.05, file_name_context=None):
+		alpha=0.05, file_name_context=None, seed=None, workers=1, tolerance=None):
+	return response_surfaces(doses_a, responses_all_a, doses_b, responses_all_b, doses_a_ab,
+		doses_b_ab, responses_all_ab, positive_control, sampling_iterations, sample_size,
+		model_sizes=(model_size,), alphas=(alpha,), file_name_context=file_name_context, seed=seed,
+		workers=workers, tolerance=tolerance)
+
+# as per formulas in Zhao 2014, https://doi.org/10.1177/1087057114521867
+# fits every model size, at every alpha, from one set of simulated theoretical responses; returns
+# one row per model size and alpha, with information criteria for comparing the model sizes
+def response_surfaces(doses_a, responses_all_a, doses_b, responses_all_b, doses_a_ab, doses_b_ab,
+		responses_all_ab, positive_control, sampling_iterations=1000, sample_size=20,
+		model_sizes=(1, 4, 6), alphas=(0.05,), file_name_context=None, seed=None, workers=1,
+		tolerance=None, plot=True):
 	positive_control_value = np.nanmean(positive_control)
 	responses_all_a = normalize(responses_all_a, maximum=100, minimum=positive_control_value)
 	responses_all_b = normalize(responses_all_b, maximum=100, minimum=positive_control_value)
 	responses_all_ab = normalize(responses_all_ab, maximum=100, minimum=positive_control_value)
 
 	#
-	# Establish a model
+	# Establish the models
 	#
 
 	est_true_responses_a = np.nanmean(responses_all_a, axis=1)
@@ -205,73 +186,128 @@ def response_surface(doses_a, responses_all_a, doses_b, responses_all_b, doses_a
 	doses_b_ab = doses_b_ab[valid_combo_idxs]
 	observed_responses_ab = observed_responses_ab[valid_combo_idxs]
 
-	if model_size == 4:
-		model_function = model_4_param
-		gamma_guess_0 = [0.5, 0, 0, 0]
-	elif model_size == 6:
-		model_function = model_6_param
-		gamma_guess_0 = [0.5, 0, 0, 0, 0, 0]
-	elif model_size == 1:
-		model_function = model_1_param
-		gamma_guess_0 = [0]
-	else:
-		raise ValueException(f'Model with {model_size} parameters is not defined')
-
-	gamma_sample_means = np.zeros((model_size, sampling_iterations))
-	gamma_sample_covars = np.zeros((model_size, model_size, sampling_iterations))
-
-	for sample_i in range(sampling_iterations):
-		gammas = np.zeros((model_size, sample_size))
-		for point_j in range(sample_size):
-			model_j = fit_model_with_noise(model_function, gamma_guess_0, doses_a, doses_b,
-				doses_a_ab, doses_b_ab, est_response_covarmat_a, est_response_covarmat_b,
-				est_true_responses_a, est_true_responses_b, observed_responses_ab)
-
-			gammas[:, point_j] = model_j.x
-
-		gamma_sample_means[:, sample_i] = np.mean(gammas, axis=1)
-		gamma_sample_covars[:, :, sample_i] = np.cov(gammas)
-
-	est_gamma = np.mean(gamma_sample_means, axis=1)
-	est_gamma_covarmat = np.mean(gamma_sample_covars, axis=2) + np.cov(gamma_sample_means)
-
-	#
-	# Use the model (mainly `est_gamma`) to predict I and CI(I)
-	#
-
-	z = scipy.stats.norm.ppf(1 - alpha/2)
-
-	est_gamma_stddev = np.sqrt(np.diagonal(est_gamma_covarmat))
-
-	interaction_index_estimates = []
-	interaction_index_ci_his = []
-	interaction_index_ci_los = []
-
-	for dose_a, dose_b in zip(doses_a_ab, doses_b_ab):
-		dose_a, dose_b = float(dose_a), float(dose_b)
-		x = np.array([1, dose_a, dose_b, dose_a * dose_b, dose_a**2, dose_b**2])
-		x = x[:model_size] # trim to appropriate size
-
-		interaction_index_estimate = np.dot(x, est_gamma)
-		interaction_index_uncertainty = \
-			z * np.sqrt(x @ est_gamma_covarmat @ x) # @ is matrix multiplication
-		interaction_index_estimates.append(interaction_index_estimate)
-		interaction_index_ci_his.append(
-			interaction_index_estimate + interaction_index_uncertainty)
-		interaction_index_ci_los.append(
-			interaction_index_estimate - interaction_index_uncertainty)
+	design_matrices = [get_design_matrix(doses_a_ab, doses_b_ab, size) for size in model_sizes]
+	dose_idxs_a = _get_dose_idxs(doses_a, doses_a_ab)
+	dose_idxs_b = _get_dose_idxs(doses_b, doses_b_ab)
+
+	# with every model's solver stacked, each noise draw yields every model's gammas at once
+	all_gamma_sample_means, all_gamma_sample_covars = sample_gammas(
+		np.vstack([np.linalg.pinv(design_matrix) for design_matrix in design_matrices]),
+		dose_idxs_a, dose_idxs_b, est_true_responses_a, est_true_responses_b,
+		observed_responses_ab, est_response_covarmat_a, est_response_covarmat_b,
+		sampling_iterations, sample_size, seed, workers, tolerance, min(alphas))
+	iterations_used = len(all_gamma_sample_means)
+	if tolerance is not None:
+		print(f'Sampling used {iterations_used} of {sampling_iterations} iterations '
+			f'({iterations_used * sample_size} noise draws) at tolerance {tolerance}')
+
+	# the noiseless excess over Bliss, which each model's interaction index is fit to
+	excesses_ab = _get_bliss_excesses(dose_idxs_a, dose_idxs_b, est_true_responses_a,
+		est_true_responses_b, observed_responses_ab, np.zeros((1, len(doses_a))),
+		np.zeros((1, len(doses_b))))[0]
+	point_count = len(excesses_ab)
 
 	dose_a_0 = doses_a[0]
 	dose_b_0 = doses_b[0]
-
-	plot_heatmap(dose_a_0.drug, dose_b_0.drug, dose_a_0.unit, dose_b_0.unit, doses_a, doses_b,
-		est_true_responses_a, est_true_responses_b, doses_a_ab, doses_b_ab, observed_responses_ab,
-		interaction_index_estimates, interaction_index_ci_his, interaction_index_ci_los, model_size,
-		file_name_context=file_name_context)
-	print_gamma_table(est_gamma, est_gamma + est_gamma_stddev*z, est_gamma - est_gamma_stddev*z,
-		model_size)
-	print_mean(doses_a, doses_b, est_true_responses_a, est_true_responses_b, doses_a_ab, doses_b_ab,
-		observed_responses_ab)
+	results = []
+	offset = 0
+
+	for model_size, design_matrix in zip(model_sizes, design_matrices):
+		gamma_idxs = slice(offset, offset + model_size)
+		offset += model_size
+		gamma_sample_means = all_gamma_sample_means[:, gamma_idxs]
+		gamma_sample_covars = all_gamma_sample_covars[:, gamma_idxs, gamma_idxs]
+
+		est_gamma = np.mean(gamma_sample_means, axis=0)
+		est_gamma_covarmat = np.mean(gamma_sample_covars, axis=0) \
+			+ np.atleast_2d(np.cov(gamma_sample_means, rowvar=False))
+		est_gamma_stddev = np.sqrt(np.diagonal(est_gamma_covarmat))
+
+		residual_sum_of_squares = np.sum((excesses_ab - design_matrix @ est_gamma)**2)
+		log_likelihood_term = point_count * np.log(residual_sum_of_squares / point_count)
+
+		#
+		# Use the model (mainly `est_gamma`) to predict I and CI(I)
+		#
+
+		interaction_index_estimates = design_matrix @ est_gamma
+		interaction_index_stddevs = np.sqrt(
+			np.einsum('ij,jk,ik->i', design_matrix, est_gamma_covarmat, design_matrix))
+
+		for alpha in alphas:
+			z = scipy.stats.norm.ppf(1 - alpha/2)
+			gamma_ci_his = est_gamma + est_gamma_stddev*z
+			gamma_ci_los = est_gamma - est_gamma_stddev*z
+
+			if plot:
+				plot_heatmap(dose_a_0.drug, dose_b_0.drug, dose_a_0.unit, dose_b_0.unit, doses_a,
+					doses_b, est_true_responses_a, est_true_responses_b, doses_a_ab, doses_b_ab,
+					observed_responses_ab, interaction_index_estimates,
+					interaction_index_estimates + z*interaction_index_stddevs,
+					interaction_index_estimates - z*interaction_index_stddevs, model_size,
+					file_name_context=file_name_context, alpha=alpha)
+				print_gamma_table(est_gamma, gamma_ci_his, gamma_ci_los, model_size, alpha=alpha)
+
+			results.append({
+				'Model Size': model_size,
+				'Alpha': alpha,
+				'Gamma': est_gamma,
+				'CI (high)': gamma_ci_his,
+				'CI (low)': gamma_ci_los,
+				'Significant': gamma_ci_los * gamma_ci_his > 0,
+				'RSS': residual_sum_of_squares,
+				'AIC': log_likelihood_term + 2*model_size,
+				'BIC': log_likelihood_term + np.log(point_count)*model_size,
+				'Iterations': iterations_used,
+			})
+
+	if plot:
+		print_mean(doses_a, doses_b, est_true_responses_a, est_true_responses_b, doses_a_ab,
+			doses_b_ab, observed_responses_ab)
+
+	return pd.DataFrame(results)
+
+# each block of iterations gets its own spawned random stream, so for a given seed the samples
+# are the same however the blocks are distributed across worker processes; `solver` is as for
+# fit_models_with_noise
+def sample_gammas(solver, dose_idxs_a, dose_idxs_b, est_true_responses_a,
+		est_true_responses_b, observed_responses_ab, est_response_covarmat_a,
+		est_response_covarmat_b, sampling_iterations=1000, sample_size=20, seed=None, workers=1,
+		tolerance=None, alpha=0.05):
+	block_sizes = [min(SAMPLING_BLOCK_SIZE, sampling_iterations - start)
+		for start in range(0, sampling_iterations, SAMPLING_BLOCK_SIZE)]
+	seed_sequences = np.random.SeedSequence(seed).spawn(len(block_sizes))
+	sample_block = functools.partial(_sample_block, solver, dose_idxs_a, dose_idxs_b,
+		est_true_responses_a, est_true_responses_b, observed_responses_ab,
+		est_response_covarmat_a, est_response_covarmat_b, sample_size)
+
+	# with a tolerance, blocks are only computed a batch at a time, so sampling can stop early
+	batch_size = len(block_sizes) if tolerance is None else max(workers, 1)
+	executor = ProcessPoolExecutor(max_workers=workers) \
+		if workers > 1 and len(block_sizes) > 1 else None
+	blocks = []
+	ci_half_widths = None
+	converged = False
+	try:
+		for start in range(0, len(block_sizes), batch_size):
+			batch = (executor.map if executor else map)(sample_block,
+				block_sizes[start:start + batch_size], seed_sequences[start:start + batch_size])
+			for block in batch:
+				blocks.append(block)
+				if tolerance is not None and len(blocks) > 1:
+					# checked block by block, so where sampling stops doesn't depend on batch size
+					converged, ci_half_widths = _has_converged(
+						blocks, ci_half_widths, tolerance, alpha)
+					if converged:
+						break
+			if converged:
+				break
+	finally:
+		if executor:
+			executor.shutdown(cancel_futures=True)
+
+	return np.concatenate([means for means, _ in blocks]), \
+		np.concatenate([covars for _, covars in blocks])
 
 def row2label(row):
 	if np.isnan(row['I']):
@@ -280,6 +316,61 @@ def row2label(row):
 		return 'I = {:.2f}\nM(I) = {:.2f}\n({:.2f}, {:.2f})\n{}'.format(
 			row['I'], row['M(I)'], row['CI(I, lo)'], row['CI(I, hi)'], row['significance'])
 
+def _get_bliss_excesses(dose_idxs_a, dose_idxs_b, est_true_responses_a, est_true_responses_b,
+		observed_responses_ab, noises_a, noises_b):
+	true_a = est_true_responses_a[dose_idxs_a]
+	true_b = est_true_responses_b[dose_idxs_b]
+	noises_a = noises_a[:, dose_idxs_a]
+	noises_b = noises_b[:, dose_idxs_b]
+
+	# Zhao 2014, Eq. 5, one row per noise realization
+	est_theoretical_responses_ab = true_a + true_b - true_a*true_b \
+		+ noises_a + noises_b - noises_a*noises_b
+
+	return observed_responses_ab - est_theoretical_responses_ab
+
+def _get_dose_idxs(doses, doses_ab):
+	dose_idxs = {dose: idx for idx, dose in enumerate(doses)}
+	return np.array([dose_idxs[dose] for dose in doses_ab])
+
+# converged once the Monte-Carlo standard error of est_gamma, and the change in the gamma CI
+# half-widths since the previous block, are both within the (absolute) tolerance
+def _has_converged(blocks, previous_ci_half_widths, tolerance, alpha):
+	gamma_sample_means = np.concatenate([means for means, _ in blocks])
+	gamma_sample_covars = np.concatenate([covars for _, covars in blocks])
+
+	est_gamma_mcse = np.std(gamma_sample_means, axis=0, ddof=1) / np.sqrt(len(gamma_sample_means))
+	est_gamma_covarmat = np.mean(gamma_sample_covars, axis=0) \
+		+ np.atleast_2d(np.cov(gamma_sample_means, rowvar=False))
+	ci_half_widths = scipy.stats.norm.ppf(1 - alpha/2) * np.sqrt(np.diagonal(est_gamma_covarmat))
+
+	converged = previous_ci_half_widths is not None and np.all(est_gamma_mcse <= tolerance) \
+		and np.all(np.abs(ci_half_widths - previous_ci_half_widths) <= tolerance)
+	return converged, ci_half_widths
+
+def _sample_block(solver, dose_idxs_a, dose_idxs_b, est_true_responses_a,
+		est_true_responses_b, observed_responses_ab, est_response_covarmat_a,
+		est_response_covarmat_b, sample_size, sampling_iterations, seed_sequence):
+	rng = np.random.default_rng(seed_sequence)
+
+	# draw every noise realization in the block up front, then fit them all in one pass
+	draw_count = sampling_iterations * sample_size
+	noises_a = rng.multivariate_normal(np.zeros(len(est_true_responses_a)),
+		est_response_covarmat_a, size=draw_count)
+	noises_b = rng.multivariate_normal(np.zeros(len(est_true_responses_b)),
+		est_response_covarmat_b, size=draw_count)
+
+	gammas = fit_models_with_noise(solver, dose_idxs_a, dose_idxs_b, est_true_responses_a,
+		est_true_responses_b, observed_responses_ab, noises_a, noises_b)
+	gammas = gammas.reshape(sampling_iterations, sample_size, -1)
+
+	gamma_sample_means = np.mean(gammas, axis=1)
+	gamma_deviations = gammas - gamma_sample_means[:, np.newaxis, :]
+	gamma_sample_covars = np.einsum('ijk,ijl->ikl', gamma_deviations, gamma_deviations) \
+		/ (sample_size - 1)
+
+	return gamma_sample_means, gamma_sample_covars
+
 if __name__ == '__main__':
 	## example/test values
 
@@ -323,12 +414,7 @@ if __name__ == '__main__':
 	])
 	positive_control = np.array([10.0, 6.0, 6.0, 5.0])
 
-	response_surface(
-		doses_a, responses_all_a, doses_b, responses_all_b, doses_a_ab, doses_b_ab,
-		responses_all_ab, positive_control, model_size=1)
-	response_surface(
-		doses_a, responses_all_a, doses_b, responses_all_b, doses_a_ab, doses_b_ab,
-		responses_all_ab, positive_control, model_size=4)
-	response_surface(
+	results = response_surfaces(
 		doses_a, responses_all_a, doses_b, responses_all_b, doses_a_ab, doses_b_ab,
-		responses_all_ab, positive_control, model_size=6)
+		responses_all_ab, positive_control, model_sizes=(1, 4, 6), alphas=(0.05, 0.1))
+	print(results[['Model Size', 'Alpha', 'RSS', 'AIC', 'BIC', 'Iterations']])
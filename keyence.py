@@ -11,6 +11,8 @@ ROWS = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
 
 LAYOUT_DEFAULT = [letter for letter in COLUMNS for _ in range(10)]
 
+XML_SCAN_LIMIT = 2**20 # how far before the end of a file its xml may start
+
 lens_table = 'keyence_BZX800_lenses.csv'
 lenses = {}
 
@@ -25,18 +27,77 @@ with open(os.path.join(util.get_here(), lens_table), encoding='utf8', newline=''
 			'Working Distance': float(working_distance)
 		}
 
-def extract_metadata(filename):
-	with open(filename, 'br') as f:
-		file_content = f.read()
-		start = file_content.find(b'<?xml')
-		xml = str(file_content[start:], 'utf-8')
+_indexes = {}
 
+def extract_metadata(filename):
 	try:
-		main = element_tree.fromstring(xml).find('SingleFileProperty')
+		return _parse_metadata(_read_xml(filename))
 	except element_tree.ParseError:
 		print('No xml data found.')
 		exit(1)
 
+def get_metadata(filename):
+	directory = os.path.dirname(os.path.abspath(filename))
+	if directory not in _indexes:
+		_indexes[directory] = index_metadata(directory)
+
+	metadata = _indexes[directory].get(os.path.basename(filename), {}).get('metadata')
+	return metadata if metadata is not None else extract_metadata(filename)
+
+def index_metadata(directory):
+	indexfile = util.get_metadata_indexfile(directory=os.path.abspath(directory))
+	index = {}
+	if os.path.exists(indexfile):
+		with open(indexfile, 'r', encoding='utf8') as f:
+			index = json.load(f)
+
+	changed = False
+	current = {}
+	for name in sorted(os.listdir(directory)):
+		if not name.lower().endswith(('.tif', '.tiff')):
+			continue
+
+		filename = os.path.join(directory, name)
+		fingerprint = util.get_file_fingerprint(filename)
+		if name in index and index[name]['fingerprint'] == fingerprint:
+			current[name] = index[name]
+			continue
+
+		try:
+			metadata = _parse_metadata(_read_xml(filename))
+		except (element_tree.ParseError, AttributeError, KeyError): # not a Keyence image
+			metadata = None
+		current[name] = {'fingerprint': fingerprint, 'metadata': metadata}
+		changed = True
+
+	if changed or current.keys() != index.keys():
+		temp_indexfile = f'{indexfile}.{os.getpid()}.tmp'
+		with open(temp_indexfile, 'w', encoding='utf8') as f: # write then rename
+			json.dump(current, f, ensure_ascii=False)
+		os.replace(temp_indexfile, indexfile)
+
+	return current
+
+def well_to_xy(well):
+	col = well[0]
+	row = int(well[1:])
+
+	return COLUMNS.index(col)*10 + ROWS.index(row) + 1
+
+def xy_to_well(xy_num):
+	xy_num -= 1
+
+	return COLUMNS[xy_num // 10] + str(ROWS[xy_num % 10])
+
+def _getxml(element, *fields):
+	for field in fields:
+		element = element.find(field)
+
+	return element.text
+
+def _parse_metadata(xml):
+	main = element_tree.fromstring(xml).find('SingleFileProperty')
+
 	metadata = {}
 
 	metadata['Aperture'] = int(_getxml(main, 'Shooting', 'Parameter', 'Aperture')) / 100
@@ -64,22 +125,28 @@ def extract_metadata(filename):
 
 	return metadata
 
-def well_to_xy(well):
-	col = well[0]
-	row = int(well[1:])
-
-	return COLUMNS.index(col)*10 + ROWS.index(row) + 1
-
-def xy_to_well(xy_num):
-	xy_num -= 1
-
-	return COLUMNS[xy_num // 10] + str(ROWS[xy_num % 10])
-
-def _getxml(element, *fields):
-	for field in fields:
-		element = element.find(field)
-
-	return element.text
+def _read_xml(filename, chunk_size=2**16):
+	# the xml is appended after the image data, so scan backwards from the end for its start,
+	# searching each chunk once, plus the few bytes of the next that a split marker needs
+	marker = b'<?xml'
+	with open(filename, 'br') as f:
+		end = f.seek(0, os.SEEK_END)
+		f.seek(max(0, end - 16))
+		if not f.read().rstrip().endswith(b'>'): # not a Keyence image: no xml at the end
+			return ''
+
+		limit = max(0, end - XML_SCAN_LIMIT)
+		chunks = []
+		while end > limit:
+			start = max(limit, end - chunk_size)
+			f.seek(start)
+			chunks.append(f.read(end - start))
+			end = start
+			found = (chunks[-1] + chunks[-2][:len(marker) - 1] if len(chunks) > 1 \
+				else chunks[-1]).find(marker)
+			if found >= 0:
+				return str(b''.join(reversed(chunks))[found:], 'utf-8')
+	return ''
 
 
 if __name__ == '__main__':
@@ -1,6 +1,5 @@
 import argparse
 import copy
-import json
 import math
 import numpy as np
 import os
@@ -16,6 +15,7 @@ import warnings
 import absolute
 import analyze
 import dose_response
+import imageops
 import interactions2
 import util
 
@@ -126,9 +126,16 @@ def generate_plate_schematic(schematic, results, conversions=None, plate_info='[
 def main(imagefiles, cap=-1, chartfile=None, checkerboard=False, conversions=[], debug=0,
 		group_regex='.*', platefile=None, plate_control=['B'], plate_ignore=[], plate_info=None,
 		plate_positive_control=[], treatment_platefile=None, absolute_chart=False, silent=False,
-		talk=False):
-	hashfile = util.get_inputs_hashfile(imagefiles=imagefiles, cap=cap, group_regex=group_regex,
-		platefile=platefile, plate_control=plate_control, plate_ignore=plate_ignore)
+		talk=False, workers=1, roi=False, mask_cache=True, cache_contents=False,
+		stream=False, mask_level=0, bootstrap=0, seed=None):
+	# raw scores don't depend on grouping or normalization, so changing those never re-quantifies;
+	# each row is checked against its own image's files, so every input set shares one store
+	scorefile = util.get_scorefile(image_type=analyze.Image.__name__,
+		channels=(analyze.Image.channel, analyze.Image.channel_subtr),
+		particles=analyze.Image.particles, mask_level=mask_level, roi=roi,
+		version=(imageops.MASK_STEPS_VERSION, imageops.SCORE_VERSION))
+	# raw image values are reused per image, for as long as that image's files are unchanged
+	scores = util.load_scores(scorefile) if debug == 0 else {} # with debug, recompute everything
 
 	if talk:
 		sns.set_context('talk')
@@ -140,19 +147,17 @@ def main(imagefiles, cap=-1, chartfile=None, checkerboard=False, conversions=[],
 		abs_chartfile = adjust_absolute_filename(chartfile)
 		results2 = absolute.main(imagefiles, cap=cap, chartfile=abs_chartfile, debug=0,
 			group_regex=group_regex, platefile=platefile, plate_control=plate_control,
-			plate_ignore=plate_ignore, silent=False)
+			plate_ignore=plate_ignore, silent=False, workers=workers, roi=roi,
+			mask_cache=mask_cache, cache=scores, cache_contents=cache_contents, stream=stream,
+			mask_level=mask_level)
 		results2 = {util.Solution(key, conversions): value for key, value in results2.items()}
 		generate_plate_schematic(schematic, results2, conversions=conversions,
 			plate_info=plate_info, scale=(ABS_MIN, ABS_MAX), well_count=96)
 
-	if chartfile is None and debug == 0 and os.path.exists(hashfile):
-		with open(hashfile, 'r') as f: # read cached results
-			results = json.load(f)
-	else:
-		results = analyze.main(imagefiles, cap, chartfile, debug, group_regex, platefile,
-			plate_control, plate_ignore, silent=False)
-		with open(hashfile, 'w') as f: # cache results for reuse
-			json.dump(results, f)
+	results = analyze.main(imagefiles, cap, chartfile, debug, group_regex, platefile,
+		plate_control, plate_ignore, silent=False, workers=workers, roi=roi, mask_cache=mask_cache,
+		cache=scores, cache_contents=cache_contents, stream=stream, mask_level=mask_level)
+	util.save_scores(scorefile, scores)
 
 	drug_conditions = _parse_results(results, conversions)
 	control_drugs = [util.Cocktail(util.Dose(control).drug) for control in plate_control]
@@ -183,6 +188,7 @@ def main(imagefiles, cap=-1, chartfile=None, checkerboard=False, conversions=[],
 
 	# generate models, dose-response charts
 
+	curves = {}
 	for cocktail, conditions in drug_conditions.items():
 		if cocktail in control_drugs:
 			continue
@@ -197,20 +203,49 @@ def main(imagefiles, cap=-1, chartfile=None, checkerboard=False, conversions=[],
 				warnings.simplefilter('ignore', RuntimeWarning)
 				summary_score = np.nanmedian(results[solution])
 				summary_scores.append(summary_score)
+		curves[cocktail] = (conditions, summary_scores, cocktail_scores, results[solution])
+
+	# every curve is fit at once; any the batch fit can't handle are refit individually
+	fittable = [cocktail for cocktail, curve in curves.items() if len(curve[1]) >= 4]
+	point_count = max((len(curves[cocktail][1]) for cocktail in fittable), default=0)
+	padding = lambda values: list(values) + [np.nan] * (point_count - len(values))
+	padded_xs = [padding([float(x) for x in curves[cocktail][0]]) for cocktail in fittable]
+	padded_ys = [padding(curves[cocktail][1]) for cocktail in fittable]
+	params, converged = dose_response.fit_log_logistic_batch(padded_xs, padded_ys)
+	pcovs = dose_response.get_log_logistic_pcovs(padded_xs, padded_ys, params)
+	fits = {cocktail: (fit, pcov) for cocktail, fit, pcov, fit_converged \
+		in zip(fittable, params, pcovs, converged) if fit_converged}
+
+	for cocktail, (conditions, summary_scores, cocktail_scores, close) in curves.items():
+		fit, pcov = fits.get(cocktail, (None, None))
 		models[cocktail] = dose_response.Model(
-			conditions, summary_scores, cocktail, E_max=positive_control_value)
-		models[cocktail].chart(results[solution], datapoints=cocktail_scores,
+			conditions, summary_scores, cocktail, E_max=positive_control_value, params=fit,
+			pcov=pcov)
+		models[cocktail].chart(close, datapoints=cocktail_scores,
 			name=plate_info + '_' + str(cocktail) if plate_info else None,
 			scale=[positive_control_value, 100])
 
 	# print EC values
 
-	for model in models.values():
-		for ec_value in (50, 75, 90, 99):
-			concentn = model.effective_concentration(ec_value / 100)
+	ec_values = (50, 75, 90, 99)
+	concentns = dose_response.effective_concentrations(
+		list(models.values()), np.array(ec_values) / 100)
+	concentn_los, concentn_his = dose_response.effective_concentration_cis(
+		list(models.values()), np.array(ec_values) / 100)
+	for model, *model_concentns in zip(models.values(), concentns, concentn_los, concentn_his):
+		for ec_value, concentn, concentn_lo, concentn_hi in zip(ec_values, *model_concentns):
 			if not np.isnan(concentn):
+				ci = '' if np.isnan(concentn_lo) else \
+					f' (95% CI {concentn_lo:.2f}-{concentn_hi:.2f}{model.get_x_units()})'
 				print((f'{model.get_condition()} '
-					f'EC_{ec_value}={concentn:.2f}{model.get_x_units()}'))
+					f'EC_{ec_value}={concentn:.2f}{model.get_x_units()}{ci}'))
+
+	if bootstrap > 0:
+		for cocktail, model in models.items():
+			if model.b:
+				print(dose_response.bootstrap_cis(model, curves[cocktail][2],
+					np.array(ec_values) / 100, iterations=bootstrap, seed=seed,
+					workers=workers).to_string(index=False))
 
 	# analyze combinations
 
@@ -255,7 +290,9 @@ def main(imagefiles, cap=-1, chartfile=None, checkerboard=False, conversions=[],
 				if model_combo.cocktail.drugs[0] in pair and model_combo.cocktail.drugs[1] in pair]
 
 			dose_response.analyze_checkerboard(model_a, model_b, models_combo_relevant,
-				method='Bliss', file_name_context=plate_info)
+				method='Bliss', file_name_context=plate_info, datapoints=results)
+			dose_response.analyze_checkerboard(model_a, model_b, models_combo_relevant,
+				method='Loewe', file_name_context=plate_info, datapoints=results)
 			dose_response.chart_checkerboard(model_a, model_b, models_combo_relevant,
 				file_name_context=plate_info)
 
@@ -285,7 +322,7 @@ def main(imagefiles, cap=-1, chartfile=None, checkerboard=False, conversions=[],
 				interactions2.response_surface(doses_a, responses_all_a, doses_b, responses_all_b,
 					doses_a_ab, doses_b_ab, responses_all_ab, positive_control_scores,
 					sampling_iterations=1000, sample_size=20, model_size=1, alpha=0.1,
-					file_name_context=plate_info)
+					file_name_context=plate_info, seed=seed, workers=workers)
 			except ValueError as ve:
 				if ve.args[0] == 'cov must be 2 dimensional and square' or \
 						ve.args[0] == 'All arrays must be of the same length':
@@ -359,6 +396,24 @@ if __name__ == '__main__':
 		help=('If present, a plate graphic will be generated with absolute (rather than relative) '
 			'brightness values.'))
 
+	parser.add_argument('--cache-contents',
+		action='store_true',
+		help=('If present, cached image values are only reused if the contents of the image files '
+			'are unchanged. Otherwise, file sizes and modification times are compared.'))
+
+	parser.add_argument('--bootstrap',
+		default=0,
+		type=int,
+		metavar='N',
+		help=('If present, dose-response parameters and EC values are also reported with '
+			'percentile confidence intervals from N bootstrap resamples of the replicate wells.'))
+
+	parser.add_argument('--seed',
+		default=None,
+		type=int,
+		help=('Seed for the random resampling in bootstrapping and in the interaction analysis, '
+			'to make results reproducible.'))
+
 	parser.add_argument('--talk',
 		action='store_true',
 		help=('If present, images will be generated with the Seaborn "talk" context. Otherwise the '
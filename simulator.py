@@ -84,6 +84,7 @@ def simulate_noise():
 	cocktail = util.Cocktail('Test1')
 	errors = {}
 
+	models_real = []
 	for i in range(10000):
 		model_real = dose_response.Model([], [], cocktail)
 		model_real.b = random.uniform(0.5, 3)
@@ -95,33 +96,24 @@ def simulate_noise():
 
 		model_real.xs = np.array([0, ec75_real/4, ec75_real/2, ec75_real, 2 * ec75_real])
 		model_real.ys = model_real.get_ys(model_real.xs)
+		models_real.append(model_real)
 
-		noisy_ys = [add_noise(y) for y in model_real.ys]
+	noisy_yss = [[add_noise(y) for y in model_real.ys] for model_real in models_real]
+	params, converged = dose_response.fit_log_logistic_batch(
+		[model_real.xs for model_real in models_real], noisy_yss, cache=False) # all unique
 
-		try:
-			model_noisy = dose_response.Model(model_real.xs, noisy_ys, cocktail)
-		except RuntimeError:
-			# sometimes the random values yield an invalid result -- that's fine, move on
-			continue
+	models_noisy = [dose_response.Model(model_real.xs, noisy_ys, cocktail, params=fit) \
+		for model_real, noisy_ys, fit in zip(models_real, noisy_yss, params)]
 
-		ec25_real = model_real.effective_concentration(0.25)
-		ec50_real = model_real.effective_concentration(0.5)
-		ec90_real = model_real.effective_concentration(0.9)
+	# sometimes the random values yield an invalid result -- that's fine, leave those out
+	models_real = [model for model, fit_converged in zip(models_real, converged) if fit_converged]
+	models_noisy = [model for model, fit_converged in zip(models_noisy, converged) if fit_converged]
 
-		ec25_noisy = model_noisy.effective_concentration(0.25)
-		ec50_noisy = model_noisy.effective_concentration(0.5)
-		ec75_noisy = model_noisy.effective_concentration(0.75)
-		ec90_noisy = model_noisy.effective_concentration(0.9)
-
-		error_ec25 = abs(ec25_real - ec25_noisy) / ec25_real
-		error_ec50 = abs(ec50_real - ec50_noisy) / ec50_real
-		error_ec75 = abs(ec75_real - ec75_noisy) / ec75_real
-		error_ec90 = abs(ec90_real - ec90_noisy) / ec90_real
-
-		util.put_multimap(errors, 25, error_ec25)
-		util.put_multimap(errors, 50, error_ec50)
-		util.put_multimap(errors, 75, error_ec75)
-		util.put_multimap(errors, 90, error_ec90)
+	ec_values = (25, 50, 75, 90)
+	ecs_real = dose_response.effective_concentrations(models_real, np.array(ec_values) / 100)
+	ecs_noisy = dose_response.effective_concentrations(models_noisy, np.array(ec_values) / 100)
+	for ec_value, ec_errors in zip(ec_values, (np.abs(ecs_real - ecs_noisy) / ecs_real).T):
+		errors[ec_value] = list(ec_errors)
 
 	errors_df = pd.DataFrame({
 		'EC value': [key for key, values in errors.items() for _ in values],
@@ -1,6 +1,10 @@
 import numpy as np
+import os
+import tempfile
 
 import dose_response
+import interactions2
+import keyence
 import util
 
 def test():
@@ -24,6 +28,17 @@ def test():
 	assert util.extract_number('4-score and 20 years ago') == 4
 	assert util.extract_number('pi is approximately 3.14159') == 3.14159
 
+	# util.get_file_fingerprint
+
+	example_filename = os.path.join(util.get_here(), 'examples', 'example_XY01_CH1.tif')
+	assert util.get_file_fingerprint('nonexistent.tif') is None
+	assert util.get_file_fingerprint(example_filename) == \
+		util.get_file_fingerprint(example_filename)
+	assert util.get_file_fingerprint(example_filename, content=True)[0] == \
+		os.path.getsize(example_filename)
+	assert util.get_file_fingerprint(example_filename, content=True) != \
+		util.get_file_fingerprint(example_filename.replace('XY01', 'XY18'), content=True)
+
 	# util.get_inputs_hashfile
 
 	assert util.get_inputs_hashfile(dummy1=1, dummy2='two', dummy3=3.0) == \
@@ -31,6 +46,26 @@ def test():
 	assert util.get_inputs_hashfile(dummy1=1, dummy2='two', dummy3=3.0) != \
 		util.get_inputs_hashfile(dummy1=1, dummy2='two', dummy3=4.0)
 
+	# util.load_fits, util.save_fits
+
+	assert util.load_fits('nonexistent.json') == {}
+	with tempfile.TemporaryDirectory() as temp_dir:
+		fitfile = os.path.join(temp_dir, 'fits.json')
+		fits = {key: {'params': [1, 2, 3], 'used': used} for key, used in zip('abcd', (4, 1, 3, 2))}
+		util.save_fits(fitfile, fits, max_entries=2)
+		assert util.load_fits(fitfile).keys() == {'a', 'c'} # least recently used are evicted
+
+	# util.load_scores, util.save_scores
+
+	assert util.load_scores('nonexistent.csv') == {}
+	with tempfile.TemporaryDirectory() as temp_dir:
+		scorefile = os.path.join(temp_dir, 'scores.csv')
+		score = {'plate': 'Plate1', 'xy': 1, 'group': 'B', 'fl_filename': 'a_XY01_CH1.tif',
+			'bf_filename': 'a_XY01_CH4.tif', 'subtr_filename': 'a_XY01_CH2.tif',
+			'mask_filename': 'a_XY01_mask.tif', 'fingerprints': [[1, 2], None], 'value': 3.5}
+		util.save_scores(scorefile, {score['fl_filename']: score})
+		assert util.load_scores(scorefile) == {score['fl_filename']: score}
+
 	# util.put_multimap
 
 	dict_ = {}
@@ -158,6 +193,65 @@ def test():
 	assert util.Solution('XYZ 1μM + ABC 10μg/mL').get_cocktail() == \
 		util.Cocktail(('XYZ', 'ABC'), ratio=util.Ratio(1, 10))
 
+	#
+	# keyence
+	#
+
+	# keyence.get_metadata
+
+	metadata = keyence.get_metadata(example_filename)
+	assert metadata == keyence.extract_metadata(example_filename)
+	assert metadata['Exposure']['Value'] > 0
+	assert keyence.index_metadata(os.path.dirname(example_filename)) \
+		[os.path.basename(example_filename)]['metadata'] == metadata
+	xml = keyence._read_xml(example_filename)
+	assert xml.startswith('<?xml')
+	assert keyence._read_xml(example_filename, chunk_size=7) == xml # markers split across chunks
+
+	#
+	# interactions2
+	#
+
+	# interactions2.fit_models_with_noise
+
+	doses_a, doses_b = np.array([1.0, 2.0, 4.0]), np.array([0.5, 1.0, 2.0])
+	doses_a_ab, doses_b_ab = np.tile(doses_a, 3), np.repeat(doses_b, 3)
+	true_a, true_b = np.array([0.1, 0.3, 0.6]), np.array([0.2, 0.4, 0.7])
+	observed_ab = np.linspace(0.2, 0.9, 9)
+	noises_a, noises_b = np.array([[0.01, -0.02, 0.03]]), np.array([[-0.01, 0.02, 0.0]])
+	idxs_a, idxs_b = np.tile(np.arange(3), 3), np.repeat(np.arange(3), 3)
+	theoretical_ab = true_a[idxs_a] + true_b[idxs_b] - true_a[idxs_a]*true_b[idxs_b] \
+		+ noises_a[0, idxs_a] + noises_b[0, idxs_b] - noises_a[0, idxs_a]*noises_b[0, idxs_b]
+	design_matrix = interactions2.get_design_matrix(doses_a_ab, doses_b_ab, 4)
+	gammas = interactions2.fit_models_with_noise(np.linalg.pinv(design_matrix), idxs_a, idxs_b,
+		true_a, true_b, observed_ab, noises_a, noises_b)
+	assert np.allclose(gammas[0],
+		np.linalg.lstsq(design_matrix, observed_ab - theoretical_ab, rcond=None)[0])
+
+	# interactions2.sample_gammas
+
+	sampling_args = (np.linalg.pinv(design_matrix), idxs_a, idxs_b,
+		true_a, true_b, observed_ab, np.eye(3) * 0.01, np.eye(3) * 0.01, 120, 20)
+	means_1, covars_1 = interactions2.sample_gammas(*sampling_args, seed=7, workers=1)
+	means_2, covars_2 = interactions2.sample_gammas(*sampling_args, seed=7, workers=2)
+	assert means_1.shape == (120, 4) and covars_1.shape == (120, 4, 4)
+	assert np.array_equal(means_1, means_2) and np.array_equal(covars_1, covars_2)
+	means_t, _ = interactions2.sample_gammas(*sampling_args[:-2], 1000, 20, seed=7, tolerance=1)
+	assert len(means_t) == 3 * interactions2.SAMPLING_BLOCK_SIZE # earliest possible stop
+
+	# interactions2.response_surfaces
+
+	responses_all_a = np.array([[90, 95, 100], [70, 75, 80], [40, 45, 50]], dtype=float)
+	responses_all_b = np.array([[85, 90, 95], [60, 65, 70], [30, 35, 40]], dtype=float)
+	responses_all_ab = np.linspace(90, 10, 9)[:, np.newaxis] + np.array([[-5, 0, 5]])
+	results = interactions2.response_surfaces(doses_a, responses_all_a, doses_b, responses_all_b,
+		doses_a_ab, doses_b_ab, responses_all_ab, np.array([5.0, 10.0]), sampling_iterations=100,
+		alphas=(0.05, 0.1), seed=7, plot=False)
+	assert results['Model Size'].tolist() == [1, 1, 4, 4, 6, 6]
+	assert results['RSS'].is_monotonic_decreasing # nested models fit at least as well
+	assert np.all(results['CI (high)'][1] - results['CI (low)'][1] \
+		< results['CI (high)'][0] - results['CI (low)'][0]) # higher alpha, narrower CI
+
 	#
 	# dose_response
 	#
@@ -213,6 +307,50 @@ def test():
 		dose_response.do_FIC(a_i=400, b_i=2.28538, A_E50_a=65.8, B_E50_b=3.99, E_max_a=1.58, E_max_b=4.17,
 			B_i=5.2, p=1.73,q=1.92))
 
+	# dose_response.effective_concentrations, dose_response.get_pct_survivals
+
+	model = dose_response._get_neo_model()
+	unfit_model = dose_response.Model([], [], model.cocktail)
+	concentrations = dose_response.effective_concentrations([model, unfit_model], [0.5, 0.9, 0.99])
+	assert concentrations.shape == (2, 3)
+	assert concentrations[0, 0] == model.effective_concentration(0.5)
+	assert concentrations[0, 0] < concentrations[0, 1]
+	assert np.isnan(concentrations[0, 2]) # unreachable
+	assert np.all(np.isnan(concentrations[1]))
+	pct_survivals = dose_response.get_pct_survivals([model, unfit_model], xs=[0, 2000])
+	assert util.equalsish(1, pct_survivals[0, 0])
+	assert np.all(np.isnan(pct_survivals[1]))
+	assert np.allclose(
+		dose_response.get_pct_survivals([model], ys=[100, model.get_absolute_E_max()]), [[1, 0]])
+	unfit_model = dose_response.Model([], [], model.cocktail, E_max=5)
+	assert np.allclose(dose_response.get_pct_survivals([unfit_model], ys=[100, 5]), [[1, 0]])
+	assert unfit_model.get_pct_survival(ys=5) == 0
+
+	# dose_response.bootstrap_cis
+
+	datapoints = {}
+	for x, y in zip(model.xs, model.ys):
+		util.put_multimap(datapoints, x, y)
+	median_model = dose_response.Model(list(datapoints),
+		[np.median(values) for values in datapoints.values()], model.cocktail, E_max=model.E_max)
+	cis = dose_response.bootstrap_cis(
+		median_model, datapoints, [0.5], iterations=200, seed=0, silent=True)
+	assert list(cis['Parameter']) == ['b', 'c', 'e', 'EC_50']
+	assert np.all(cis['CI (low)'] <= cis['CI (high)'])
+	assert cis['CI (low)'][3] < median_model.effective_concentration(0.5) < cis['CI (high)'][3]
+	assert cis.equals(dose_response.bootstrap_cis(
+		median_model, datapoints, [0.5], iterations=200, seed=0, workers=2, silent=True))
+
+	# dose_response.effective_concentration_cis
+
+	concentration_los, concentration_his = dose_response.effective_concentration_cis(
+		[model, unfit_model], [0.5, 0.9])
+	assert np.all(concentration_los[0] < concentrations[0, :2])
+	assert np.all(concentrations[0, :2] < concentration_his[0])
+	assert np.all(np.isnan(concentration_los[1])) and np.all(np.isnan(concentration_his[1]))
+	assert model.effective_concentration_ci(0.5) == \
+		(concentration_los[0, 0], concentration_his[0, 0])
+
 	# dose_response.filter_valid
 
 	assert dose_response.filter_valid([1, 1, 2, 3, 5, 8], minimum=3) == [3, 5, 8]
@@ -220,6 +358,163 @@ def test():
 	assert dose_response.filter_valid([1, 1, 2, 3, 5, 8], tolerance=3) == [1, 5, 8]
 	assert dose_response.filter_valid([1, 1, 2, 3, 5, 8], minimum=3, tolerance=3) == [3, 8]
 
+	# dose_response.fit_log_logistic
+
+	dose_response._save_fits() # fits so far go to the usual cache, and these to a temporary one
+	with tempfile.TemporaryDirectory() as temp_dir:
+		dose_response._fitfile = os.path.join(temp_dir, 'fits.json')
+		dose_response._fits = None
+
+		xs = np.repeat([0, 3.125, 6.25, 12.5, 25, 50, 100, 200], 3)
+		popt, pcov = dose_response.fit_log_logistic(
+			xs, dose_response.log_logistic_model(xs, 2, 10, 100, 20))
+		assert np.allclose(popt, [2, 10, 20])
+		assert pcov.shape == (3, 3)
+		assert dose_response.fit_log_logistic([1, 2, 3, 4], [np.nan]*4) == (None, None)
+		ys = dose_response.log_logistic_model(xs, 2, 10, 100, 20) + np.linspace(-1, 1, len(xs))
+		popt, pcov = dose_response.fit_log_logistic(xs, ys)
+		cached_popt, cached_pcov = dose_response.fit_log_logistic(xs, ys)
+		assert np.array_equal(popt, cached_popt) and np.array_equal(pcov, cached_pcov)
+		dose_response._save_fits()
+		assert len(util.load_fits(dose_response._fitfile)) == 3
+		saved_fits = util.load_fits(dose_response._fitfile)
+		dose_response.fit_log_logistic(xs, ys)
+		assert util.load_fits(dose_response._fitfile) == saved_fits # hits only mark fits used...
+		dose_response._save_fits()
+		assert util.load_fits(dose_response._fitfile) != saved_fits # ...which is saved at exit
+		assert np.allclose(popt, dose_response.fit_log_logistic(xs, ys, cache=False)[0])
+
+		# dose_response.fit_log_logistic_batch
+
+		xs = np.array([[0, 3.125, 6.25, 12.5, 25, 50, 100, 200]] * 3)
+		xs[2, 4:] = np.nan # fewer doses than the other curves
+		ys = dose_response.log_logistic_model(xs, np.array([[2], [1], [3]]),
+			np.array([[10], [30], [5]]), 100, np.array([[20], [40], [5]]))
+		params, converged = dose_response.fit_log_logistic_batch(xs, ys)
+		assert np.allclose(params, [[2, 10, 20], [1, 30, 40], [3, 5, 5]])
+		assert np.all(converged)
+		params, converged = dose_response.fit_log_logistic_batch(xs[:, :2], ys[:, :2])
+		assert np.all(np.isnan(params)) and not np.any(converged)
+		xs = np.array([0, 3.125, 6.25, 12.5, 25, 50, 100, 200])
+		ys = np.array([100, 60, 58, 55, 57, 59, 56, 58]) # a step, which batch iterations flatten
+		params, converged = dose_response.fit_log_logistic_batch(xs, ys, verify=False)
+		assert converged[0] and params[0, 0] < dose_response.BATCH_SUSPECT_SLOPES[0]
+		params, converged = dose_response.fit_log_logistic_batch(xs, ys)
+		assert converged[0] and np.allclose(params[0], dose_response.fit_log_logistic(xs, ys)[0])
+		params, converged = dose_response.fit_log_logistic_batch([], [])
+		assert params.shape == (0, 3) and converged.shape == (0,)
+		assert dose_response.get_log_logistic_pcovs([], [], params).shape == (0, 3, 3)
+		dose_response._save_fits()
+	dose_response._fitfile, dose_response._fits = None, None
+
+	# dose_response.get_bliss_excesses
+
+	model_a = dose_response.Model([util.Solution('A 1μM'), util.Solution('A 2μM')], [80, 50],
+		util.Cocktail('A'), E_max=0)
+	model_b = dose_response.Model([util.Solution('B 1μM')], [60], util.Cocktail('B'), E_max=0)
+	xs = [util.Solution('A 1μM + B 1μM'), util.Solution('A 2μM + B 1μM')]
+	model_combo = dose_response.Model(xs, [40, 20], util.Cocktail(('A', 'B')), E_max=0)
+	xs_combo, excesses = dose_response.get_bliss_excesses(model_a, model_b, [model_combo])
+	assert xs_combo == xs and np.allclose(excesses, [[0.08], [0.1]])
+	xs_combo, excesses = dose_response.get_bliss_excesses(
+		model_a, model_b, [model_combo], {xs[0]: [40, 44, 36], xs[1]: [20, 30]})
+	assert np.allclose(excesses, [[0.08, 0.04, 0.12], [0.1, 0, np.nan]], equal_nan=True)
+	assert np.isclose(dose_response.get_bliss_ixn(xs[0], 40, model_a, model_b, model_combo), 0.08)
+
+	# dose_response.get_combo_additive_expectations
+
+	model_a = dose_response.Model([], [], util.Cocktail('A'), E_max=5)
+	model_a.b, model_a.c, model_a.e = 1.6, 30, 60
+	model_b = dose_response.Model([], [], util.Cocktail('B'), E_max=5)
+	model_b.b, model_b.c, model_b.e = 2.2, 10, 4
+	ratios = [util.Ratio(1, 1), util.Ratio(25, 1), util.Ratio(1, 10)]
+	concs, converged = dose_response.get_combo_additive_expectations(0.5, model_a, model_b, ratios)
+	assert np.all(converged)
+	ec_b = model_b.effective_concentration(0.5)
+	for conc, ratio in zip(concs, ratios):
+		conc_a = conc * float(ratio.to_proportion())
+		assert np.isclose(conc - conc_a, dose_response.do_additive_isobole(conc_a, 60, 4,
+			1 - model_a.get_pct_survival(ys=30), 1 - model_a.get_pct_survival(ys=10), ec_b, 2.2, 1.6))
+	concs, converged = dose_response.get_combo_additive_expectations(0.99, model_a, model_b, ratios)
+	assert np.all(np.isnan(concs)) and not np.any(converged) # B alone never reaches the level
+
+	# dose_response.get_combo_FIC_ci
+
+	model_combo = dose_response.Model([], [], util.Cocktail(('A', 'B')), E_max=5,
+		params=(1.5, 10, 10), pcov=np.diag([0.04, 1, 1]))
+	model_a.pcov, model_b.pcov = np.diag([0.04, 4, 25]), np.diag([0.09, 1, 0.25])
+	fic = dose_response.get_combo_FIC(0.5, model_a, model_b, model_combo, util.Ratio(1, 1))
+	fic_lo, fic_hi = dose_response.get_combo_FIC_ci(
+		0.5, model_a, model_b, model_combo, util.Ratio(1, 1))
+	assert fic_lo < fic < fic_hi
+	model_combo.pcov = None
+	assert np.all(np.isnan(dose_response.get_combo_FIC_ci(
+		0.5, model_a, model_b, model_combo, util.Ratio(1, 1))))
+
+	# dose_response.get_combo_FICs, dose_response.get_FIC_spectrum
+
+	models_combo = [model_combo, model_combo.scale_doses(util.Ratio(2, 1))]
+	levels = np.linspace(0.05, 0.95, 19)
+	fics = dose_response.get_combo_FICs(levels, model_a, model_b, models_combo, ratios[:2])
+	assert fics.shape == (2, 19)
+	assert np.allclose([[dose_response.get_combo_FIC(level, model_a, model_b, combo, ratio, True) \
+		for level in levels] for combo, ratio in zip(models_combo, ratios)], fics, equal_nan=True)
+	model_combo.cocktail.ratio = util.Ratio(1, 1)
+	spectrum = dose_response.get_FIC_spectrum(model_a, model_b, [model_combo])
+	assert np.allclose(spectrum['Effect Level'], levels)
+	assert np.allclose(spectrum['Combined FIC'],
+		dose_response.get_combo_FICs(levels, model_a, model_b, [model_combo], ratios[:1])[0],
+		equal_nan=True)
+	assert list(spectrum['Combos']) == list((~np.isnan(fics[0])).astype(int))
+
+	# dose_response.get_log_logistic_pcovs
+
+	xs = np.array([float(x) for x in model.xs])
+	params, _ = dose_response.fit_log_logistic_batch(xs, model.ys)
+	unfixed_model = dose_response.Model(model.xs, model.ys, model.cocktail)
+	assert np.allclose(dose_response.get_log_logistic_pcovs(xs, model.ys, params)[0],
+		unfixed_model.pcov, rtol=1e-2)
+
+	# dose_response.get_loewe_excesses, dose_response.get_loewe_expectations
+
+	pct_inhibitions, converged = dose_response.get_loewe_expectations(
+		model_a, model_a, [10, 5, 0], [10, 15, 0]) # a sham combination, A with itself
+	assert np.all(converged)
+	assert np.allclose(pct_inhibitions, [1 - model_a.get_pct_survival(xs=20)] * 2 + [0])
+	pct_inhibitions, converged = dose_response.get_loewe_expectations(
+		model_a, model_b, [[50, 0], [20, 20]], [[0, 3], [2, 20]])
+	assert np.all(converged) and pct_inhibitions.shape == (2, 2)
+	assert np.allclose(pct_inhibitions[0], 1 - np.array(
+		[model_a.get_pct_survival(xs=50), model_b.get_pct_survival(xs=3)]))
+	concentrations = dose_response.effective_concentrations([model_a, model_b], pct_inhibitions)
+	assert np.allclose(np.nan_to_num(np.array([[[50, 0], [20, 20]], [[0, 3], [2, 20]]]) \
+		/ concentrations).sum(axis=0), 1)
+	pct_inhibitions, converged = dose_response.get_loewe_expectations(
+		model_a, dose_response.Model([], [], util.Cocktail('B')), [10], [10])
+	assert np.all(np.isnan(pct_inhibitions)) and not np.any(converged)
+	inactive_a, inactive_b = [dose_response.Model([], [], util.Cocktail(drug), E_max=5,
+		params=(1, c, 20)) for drug, c in (('A', 104), ('B', 101))] # never below E_0
+	pct_inhibitions, converged = dose_response.get_loewe_expectations(
+		inactive_a, inactive_b, [10, 0], [10, 0])
+	assert np.isnan(pct_inhibitions[0]) and pct_inhibitions[1] == 0
+	assert np.array_equal(converged, [False, True])
+	x = util.Solution('A 20μM + B 2μM')
+	model_combo = dose_response.Model([x], [50], util.Cocktail(('A', 'B')), E_max=5)
+	xs_combo, excesses, converged = dose_response.get_loewe_excesses(
+		model_a, model_b, [model_combo], {x: [50, 24]})
+	expectation = dose_response.get_loewe_expectations(model_a, model_b, [20], [2])[0][0]
+	assert xs_combo == [x] and np.all(converged)
+	assert np.allclose(excesses, [[1 - 45/95 - expectation, 1 - 19/95 - expectation]])
+
+	# dose_response.Model.pivot, dose_response.Model.scale_doses
+
+	model = dose_response._get_neo_model()
+	scaled_model = model.scale_doses(util.Ratio(3, 2))
+	assert np.isclose(scaled_model.e, model.e * 1.5)
+	assert np.isclose(scaled_model.get_ys(30), model.get_ys(20))
+	assert np.isclose(scaled_model.pcov[2, 2], model.pcov[2, 2] * 1.5**2)
+	assert dose_response.Model([], [], model.cocktail).scale_doses(2).b is None
+
 	# dose_response.Model
 
 	model = dose_response._get_neo_model()
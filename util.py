@@ -2,12 +2,17 @@ import base64
 import configparser
 import csv
 import hashlib
+import json
 import math
 import numpy as np
 import os
 import pickle
 import re
 
+CACHE_VERSION = 2 # increment whenever the layout of cache files changes, invalidating them
+SCORE_COLUMNS = ('plate', 'xy', 'group', 'fl_filename', 'bf_filename', 'subtr_filename',
+	'mask_filename', 'fingerprints', 'value', 'version')
+
 _config = None
 _section = 'Main'
 
@@ -217,17 +222,66 @@ def get_config(setting, fallback=None):
 		_config.read(f'{get_here()}/config-ext.ini')
 	return _config[_section].get(setting, fallback)
 
+def get_digest(**kwargs):
+	sha1hash = hashlib.sha1()
+	for value in kwargs.values():
+		sha1hash.update(pickle.dumps(value))
+	return base64.b32encode(sha1hash.digest()).decode('utf-8')
+
+def get_file_fingerprint(filename, content=False):
+	if not os.path.isfile(filename):
+		return None
+
+	stat = os.stat(filename)
+
+	if not content:
+		return [stat.st_size, stat.st_mtime_ns]
+
+	sha1hash = hashlib.sha1()
+	with open(filename, 'rb') as f:
+		for chunk in iter(lambda: f.read(2**20), b''):
+			sha1hash.update(chunk)
+	return [stat.st_size, sha1hash.hexdigest()]
+
 def get_here():
 	script = sys.argv[0] if __name__ == '__main__' else __file__
 	return os.path.dirname(os.path.realpath(script))
 
+def get_fit_cachefile(**kwargs):
+	return _get_hashfile('.cache', '.fits.{digest}.json', kwargs)
+
 def get_inputs_hashfile(**kwargs):
-	sha1hash = hashlib.sha1()
-	for value in kwargs.values():
-		sha1hash.update(pickle.dumps(value))
-	digest = base64.b32encode(sha1hash.digest()).decode('utf-8')
-	os.makedirs(os.path.join(get_config('log_dir'), '.cache'), exist_ok=True)
-	return os.path.join(get_config('log_dir'), '.cache', f'.{digest}.json')
+	return _get_hashfile('.cache', '.{digest}.json', kwargs)
+
+def get_mask_cachefile(**kwargs):
+	return _get_hashfile(os.path.join('.cache', 'masks'), '{digest}.npz', kwargs)
+
+def get_metadata_indexfile(**kwargs):
+	return _get_hashfile(os.path.join('.cache', 'metadata'), '{digest}.json', kwargs)
+
+def get_scorefile(**kwargs):
+	return _get_hashfile('.cache', '.{digest}.csv', kwargs)
+
+def load_fits(fitfile):
+	if not os.path.exists(fitfile):
+		return {}
+	with open(fitfile, 'r', encoding='utf8') as f:
+		return json.load(f)
+
+def load_scores(scorefile):
+	scores = {}
+
+	if os.path.exists(scorefile):
+		with open(scorefile, 'r', encoding='utf8', newline='') as f:
+			for row in csv.DictReader(f):
+				if row.pop('version', None) != str(CACHE_VERSION):
+					continue # written by an older layout, so recompute
+				row['xy'] = int(row['xy'])
+				row['fingerprints'] = json.loads(row['fingerprints'])
+				row['value'] = float(row['value'])
+				scores[row['fl_filename']] = row
+
+	return scores
 
 def plate_height(well_count):
 	sqrt = int(math.sqrt(well_count))
@@ -264,3 +318,28 @@ def remove_argument(parser, arg):
 
 def remove_arguments(parser, *args):
 	return [remove_argument(parser, arg) for arg in args]
+
+# keeps only the `max_entries` most recently used fits
+def save_fits(fitfile, fits, max_entries):
+	for key in sorted(fits, key=lambda key: fits[key]['used'])[:max(0, len(fits) - max_entries)]:
+		del fits[key]
+
+	temp_fitfile = f'{fitfile}.{os.getpid()}.tmp'
+	with open(temp_fitfile, 'w', encoding='utf8') as f: # write then rename
+		json.dump(fits, f)
+	os.replace(temp_fitfile, fitfile)
+
+def save_scores(scorefile, scores):
+	temp_scorefile = f'{scorefile}.{os.getpid()}.tmp'
+	with open(temp_scorefile, 'w', encoding='utf8', newline='') as f: # write then rename
+		writer = csv.DictWriter(f, SCORE_COLUMNS)
+		writer.writeheader()
+		for row in scores.values():
+			writer.writerow({**row, 'fingerprints': json.dumps(row['fingerprints']),
+				'version': CACHE_VERSION})
+	os.replace(temp_scorefile, scorefile)
+
+def _get_hashfile(directory, name_format, kwargs):
+	digest = get_digest(**kwargs)
+	os.makedirs(os.path.join(get_config('log_dir'), directory), exist_ok=True)
+	return os.path.join(get_config('log_dir'), directory, name_format.format(digest=digest))